@@ -0,0 +1,181 @@
+"""Local stand-in for api.quran.com used by the benchmark harness.
+
+Serves recorded payloads from ``benchmark/fixtures`` when present, otherwise
+deterministic synthetic ones with the real chapter lengths. Responses follow
+the Quran.com v4 pagination format the backend relies on.
+
+Run standalone with ``uvicorn benchmark.fake_quran_api:app --port 8081`` and
+point the backend at it with ``QURAN_API_BASE=http://localhost:8081/api/v4``.
+It also stands in for the audio origin: set
+``QURAN_AUDIO_BASE=http://localhost:8081/audio`` to exercise ``AUDIO_PROXY``.
+Record real payloads with ``python -m benchmark.fake_quran_api --chapters 1,2,36``.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI, HTTPException, Response
+
+FIXTURES_DIR = Path(os.environ.get('BENCH_FIXTURES_DIR', Path(__file__).parent / 'fixtures'))
+RESPONSE_DELAY = float(os.environ.get('FAKE_UPSTREAM_DELAY', 0.0))
+AUDIO_DELAY = float(os.environ.get('FAKE_AUDIO_DELAY', 0.0))
+
+# Same as server.VERSE_COUNTS; duplicated so the fake runs without the backend's settings
+VERSE_COUNTS = [
+    7, 286, 200, 176, 120, 165, 206, 75, 129, 109, 123, 111, 43, 52, 99, 128, 111, 110, 98, 135,
+    112, 78, 118, 64, 77, 227, 93, 88, 69, 60, 34, 30, 73, 54, 45, 83, 182, 88, 75, 85,
+    54, 53, 89, 59, 37, 35, 38, 29, 18, 45, 60, 49, 62, 55, 78, 96, 29, 22, 24, 13,
+    14, 11, 11, 18, 12, 12, 30, 52, 52, 44, 28, 28, 20, 56, 40, 31, 50, 40, 46, 42,
+    29, 19, 36, 25, 22, 17, 19, 26, 30, 20, 15, 21, 11, 8, 8, 19, 5, 8, 8, 11,
+    11, 8, 3, 9, 5, 4, 7, 3, 6, 3, 5, 4, 5, 6
+]
+
+app = FastAPI(title="Fake Quran.com API")
+
+def read_fixture(*parts):
+    path = FIXTURES_DIR.joinpath(*parts)
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return None
+
+def synthetic_chapters():
+    return [
+        {
+            "id": chapter_id,
+            "name_simple": f"Surah {chapter_id}",
+            "name_arabic": "سورة",
+            "verses_count": verses_count,
+            "revelation_place": "makkah" if chapter_id % 3 else "madinah"
+        }
+        for chapter_id, verses_count in enumerate(VERSE_COUNTS, start=1)
+    ]
+
+def synthetic_verses(chapter_id: int):
+    return [
+        {
+            "verse_number": verse_number,
+            "verse_key": f"{chapter_id}:{verse_number}",
+            "text_uthmani": "بِسْمِ ٱللَّهِ ٱلرَّحْمَٰنِ ٱلرَّحِيمِ",
+            "text_simple": "بسم الله الرحمن الرحيم",
+            "translations": [{"text": f"Verse {verse_number} of chapter {chapter_id} in the name of God"}],
+            "words": [
+                {"transliteration": {"text": "bis'mi"}},
+                {"transliteration": {"text": "l-lahi"}},
+                {"transliteration": {"text": f"v{verse_number}"}}
+            ]
+        }
+        for verse_number in range(1, VERSE_COUNTS[chapter_id - 1] + 1)
+    ]
+
+def synthetic_recitations(reciter_id: str, chapter_id: int):
+    return [
+        {"verse_key": f"{chapter_id}:{verse_number}", "url": f"reciter{reciter_id}/{chapter_id:03d}{verse_number:03d}.mp3"}
+        for verse_number in range(1, VERSE_COUNTS[chapter_id - 1] + 1)
+    ]
+
+def paginate(items, page: int, per_page: int):
+    total_pages = max(1, -(-len(items) // per_page))
+    start = (page - 1) * per_page
+    return items[start:start + per_page], {
+        "per_page": per_page,
+        "current_page": page,
+        "next_page": page + 1 if page < total_pages else None,
+        "total_pages": total_pages,
+        "total_records": len(items)
+    }
+
+async def delay():
+    if RESPONSE_DELAY:
+        await asyncio.sleep(RESPONSE_DELAY)
+
+@app.get("/api/v4/chapters")
+async def chapters():
+    await delay()
+    return {"chapters": read_fixture("chapters.json") or synthetic_chapters()}
+
+@app.get("/api/v4/verses/by_chapter/{chapter_id}")
+async def verses(chapter_id: int, page: int = 1, per_page: int = 10):
+    if not (1 <= chapter_id <= 114):
+        raise HTTPException(status_code=404, detail="Not found")
+    await delay()
+    items = read_fixture("verses", f"{chapter_id}.json") or synthetic_verses(chapter_id)
+    page_items, pagination = paginate(items, page, min(per_page, 50))
+    return {"verses": page_items, "pagination": pagination}
+
+@app.get("/api/v4/recitations/{reciter_id}/by_chapter/{chapter_id}")
+async def recitations(reciter_id: str, chapter_id: int, page: int = 1, per_page: int = 10):
+    if not (1 <= chapter_id <= 114):
+        raise HTTPException(status_code=404, detail="Not found")
+    await delay()
+    items = read_fixture("recitations", reciter_id, f"{chapter_id}.json") or synthetic_recitations(reciter_id, chapter_id)
+    page_items, pagination = paginate(items, page, min(per_page, 50))
+    return {"audio_files": page_items, "pagination": pagination}
+
+def synthetic_audio(path: str) -> bytes:
+    """Deterministic 32-160 KiB body per path, so cached copies can be checked byte for byte"""
+    seed = hashlib.sha256(path.encode()).digest()
+    size = 32 * 1024 + int.from_bytes(seed[:4], "big") % (128 * 1024)
+    return (seed * (size // len(seed) + 1))[:size]
+
+audio_requests = {"count": 0}
+
+@app.get("/audio/{path:path}")
+async def audio(path: str):
+    if not path.endswith(".mp3"):
+        raise HTTPException(status_code=404, detail="Not found")
+    audio_requests["count"] += 1
+    if AUDIO_DELAY:
+        await asyncio.sleep(AUDIO_DELAY)
+    return Response(content=synthetic_audio(path), media_type="audio/mpeg")
+
+async def record(base_url: str, chapters: list, reciters: list):
+    """Download real payloads into the fixtures directory"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+        async def fetch_all(path, key, params):
+            items, page = [], 1
+            while page:
+                response = await client.get(path, params={**params, "page": page, "per_page": 50})
+                response.raise_for_status()
+                data = response.json()
+                items.extend(data[key])
+                page = (data.get("pagination") or {}).get("next_page")
+            return items
+        
+        def write(items, *parts):
+            path = FIXTURES_DIR.joinpath(*parts)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+        
+        response = await client.get("/chapters")
+        response.raise_for_status()
+        write(response.json()["chapters"], "chapters.json")
+        for chapter_id in chapters:
+            write(await fetch_all(
+                f"/verses/by_chapter/{chapter_id}", "verses",
+                {"translations": "131", "words": "true", "fields": "text_uthmani,text_simple"}
+            ), "verses", f"{chapter_id}.json")
+            for reciter_id in reciters:
+                write(await fetch_all(
+                    f"/recitations/{reciter_id}/by_chapter/{chapter_id}", "audio_files", {}
+                ), "recitations", reciter_id, f"{chapter_id}.json")
+            print(f"Recorded chapter {chapter_id}")
+
+if __name__ == "__main__":
+    import typer
+
+    def main(
+        base_url: str = typer.Option("https://api.quran.com/api/v4", help="Upstream to record from"),
+        chapters: str = typer.Option("1,2,18,36,55,67,112,113,114", help="Comma-separated chapter ids"),
+        reciters: str = typer.Option("7", help="Comma-separated reciter ids")
+    ):
+        """Record Quran.com payloads into benchmark/fixtures."""
+        asyncio.run(record(
+            base_url,
+            [int(chapter) for chapter in chapters.split(",")],
+            [reciter for reciter in reciters.split(",") if reciter]
+        ))
+
+    typer.run(main)
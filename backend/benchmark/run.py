@@ -0,0 +1,253 @@
+"""Load test and benchmark harness for the Quran Learning API.
+
+Boots the FastAPI app in-process against a MongoDB (``--mongo-url``, default
+``mongodb://localhost:27017``) with Quran.com replaced by
+``benchmark.fake_quran_api``. The benchmark database (``BENCH_DB_NAME``,
+default ``quran_learning_bench``) is dropped before each run. Virtual users run
+scripted journeys and per-endpoint throughput and latency percentiles are
+reported. Set ``AUDIO_PROXY=true`` to include the audio caching proxy, served
+from the fake's audio origin.
+
+``--mongo-url memory`` runs against mongomock-motor (``pip install
+mongomock-motor``) for a quick smoke run; it does not implement ``$bit``, so
+progress writes fail there and such runs cannot be saved as a baseline.
+
+    cd backend
+    python -m benchmark.run --users 50 --iterations 5 --save-baseline benchmark/baseline.json
+    python -m benchmark.run --users 50 --iterations 5 --compare benchmark/baseline.json
+"""
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import typer
+
+# The harness measures the app, not the limiter or bcrypt's cost factor
+os.environ.setdefault("RATE_LIMIT_DEFAULT", "100000000/60")
+os.environ.setdefault("RATE_LIMIT_POLICIES", "")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+# Never the app's own database: it is dropped before every run
+os.environ["DB_NAME"] = os.environ.get("BENCH_DB_NAME", "quran_learning_bench")
+
+POPULAR_CHAPTERS = [1, 2, 18, 36, 55, 67, 112, 113, 114]
+SESSION_TYPES = ["reading", "memorization", "translation", "recitation"]
+
+class Recorder:
+    """Per-endpoint latency samples and error counts"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception:
+            self.errors[name] += 1
+            return None
+        self.samples[name].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        return response
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+async def user_journey(client: httpx.AsyncClient, recorder: Recorder, iterations: int, rng: random.Random):
+    """Register/login, read a chapter, play audio, log sessions and progress, view the leaderboard"""
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    password = "benchmark123"
+    response = await recorder.call(client, "POST /auth/register", "POST", "/api/auth/register",
+                                   json={"email": email, "username": f"u{uuid.uuid4().hex[:10]}", "password": password})
+    if response is None or response.status_code != 200:
+        return
+    response = await recorder.call(client, "POST /auth/login", "POST", "/api/auth/login",
+                                   json={"email": email, "password": password})
+    if response is None or response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    
+    for _ in range(iterations):
+        chapter_id = rng.choice(POPULAR_CHAPTERS)
+        await recorder.call(client, "GET /quran/chapters", "GET", "/api/quran/chapters")
+        await recorder.call(client, "GET /quran/chapter/{id}/verses", "GET", f"/api/quran/chapter/{chapter_id}/verses")
+        await recorder.call(client, "GET /quran/chapter/{id}/audio", "GET", f"/api/quran/chapter/{chapter_id}/audio?reciter=7")
+        for verse_number in range(1, 4):
+            response = await recorder.call(client, "GET /quran/verse/{id}/{n}/audio", "GET",
+                                           f"/api/quran/verse/{chapter_id}/{verse_number}/audio?reciter=7")
+            audio_url = response.json().get("audio_url") if response is not None and response.status_code == 200 else None
+            if audio_url and "/api/audio/" in audio_url:
+                # Players probe with a small range first
+                await recorder.call(client, "GET /audio/{path}", "GET", audio_url, headers={"Range": "bytes=0-65535"})
+        for _ in range(3):
+            await recorder.call(client, "POST /learning/session", "POST", "/api/learning/session", headers=headers, json={
+                "surah_number": chapter_id,
+                "ayah_number": 1,
+                "session_type": rng.choice(SESSION_TYPES),
+                "duration_minutes": rng.randint(1, 20)
+            })
+        await recorder.call(client, "POST /learning/progress", "POST", "/api/learning/progress", headers=headers, json={
+            "surah_number": chapter_id, "ayah_number": 1, "completed": True, "difficulty_level": "beginner"
+        })
+        await recorder.call(client, "GET /user/profile", "GET", "/api/user/profile", headers=headers)
+        await recorder.call(client, "GET /leaderboard", "GET", "/api/leaderboard")
+        await recorder.call(client, "GET /leaderboard/me", "GET", "/api/leaderboard/me", headers=headers)
+
+async def run_benchmark(users: int, concurrency: int, iterations: int, mongo_url: str,
+                        upstream_url: Optional[str], seed: int) -> Dict:
+    import server
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    from benchmark import fake_quran_api
+    
+    if mongo_url == "memory":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise typer.BadParameter("--mongo-url memory needs mongomock-motor (pip install mongomock-motor)")
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[os.environ["DB_NAME"]]
+    elif mongo_url:
+        server.client = server.AsyncIOMotorClient(mongo_url)
+        server.db = server.client[os.environ["DB_NAME"]]
+        await server.client.drop_database(os.environ["DB_NAME"])
+    
+    if upstream_url:
+        transport = None
+        base_url = upstream_url
+    else:
+        transport = httpx.ASGITransport(app=fake_quran_api.app)
+        base_url = "http://fake-quran/api/v4"
+    server.quran_api.client = httpx.AsyncClient(base_url=base_url, transport=transport, limits=server.quran_api.limits)
+    if server.AUDIO_PROXY and not upstream_url:
+        server.audio_cache.client = httpx.AsyncClient(
+            base_url="http://fake-quran/audio", transport=httpx.ASGITransport(app=fake_quran_api.app)
+        )
+    
+    await server.app.router.startup()
+    # Benchmark a ready worker, as the load balancer would
+    while not (server.readiness["indexes"] and server.readiness["warmup"]):
+        await asyncio.sleep(0.05)
+    
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(concurrency)
+    rng = random.Random(seed)
+    
+    async def bounded(journey_seed: int):
+        async with semaphore:
+            await user_journey(client, recorder, iterations, random.Random(journey_seed))
+    
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench", limits=limits, timeout=60.0) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded(rng.randrange(1 << 30)) for _ in range(users)))
+        elapsed = time.perf_counter() - started
+    
+    await server.app.router.shutdown()
+    
+    endpoints = {}
+    total_requests = 0
+    for name, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        total_requests += len(samples)
+        endpoints[name] = {
+            "count": len(samples),
+            "errors": recorder.errors.get(name, 0),
+            "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+            "throughput_rps": round(len(samples) / elapsed, 2)
+        }
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mongo": "memory" if mongo_url == "memory" else "mongodb",
+            "users": users,
+            "concurrency": concurrency,
+            "iterations": iterations,
+            "seed": seed
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "total_requests": total_requests,
+        "throughput_rps": round(total_requests / elapsed, 2),
+        "endpoints": endpoints
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def print_report(report: Dict):
+    typer.echo(f"{report['total_requests']} requests in {report['elapsed_seconds']}s "
+               f"({report['throughput_rps']} req/s)")
+    typer.echo(f"{'endpoint':40} {'count':>7} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+    for name, stats in report["endpoints"].items():
+        typer.echo(f"{name:40} {stats['count']:>7} {stats['errors']:>5} {stats['p50_ms']:>9} "
+                   f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['throughput_rps']:>9}")
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Endpoints whose p95 or error count regressed beyond the tolerance"""
+    regressions = []
+    for name, stats in report["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if base is None:
+            continue
+        if base["p95_ms"] and stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {stats['p95_ms']}ms")
+        if stats["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {base['errors']} -> {stats['errors']}")
+    base_rps = baseline.get("throughput_rps")
+    if base_rps and report["throughput_rps"] < base_rps * (1 - tolerance):
+        regressions.append(f"throughput {base_rps} -> {report['throughput_rps']} req/s")
+    return regressions
+
+def main(
+    users: int = typer.Option(50, help="Virtual users, each running one journey"),
+    concurrency: int = typer.Option(25, help="Journeys running at once"),
+    iterations: int = typer.Option(3, help="Read/play/log loops per journey"),
+    mongo_url: str = typer.Option(os.environ["MONGO_URL"], help="MongoDB URL, or 'memory' for mongomock-motor"),
+    upstream_url: Optional[str] = typer.Option(None, help="Use a running fake Quran.com instead of the in-process one"),
+    seed: int = typer.Option(1, help="Random seed for journeys"),
+    save_baseline: Optional[Path] = typer.Option(None, help="Write the report to this baseline file"),
+    baseline: Optional[Path] = typer.Option(None, "--compare", help="Compare against a baseline file"),
+    tolerance: float = typer.Option(0.25, help="Allowed relative regression when comparing"),
+    output: Optional[Path] = typer.Option(None, help="Write the JSON report here")
+):
+    """Run the benchmark and optionally save or compare a baseline."""
+    if mongo_url == "memory" and save_baseline is not None:
+        raise typer.BadParameter("baselines need a real MongoDB; mongomock fails progress writes", param_hint="--mongo-url")
+    report = asyncio.run(run_benchmark(users, concurrency, iterations, mongo_url, upstream_url, seed))
+    print_report(report)
+    for path in filter(None, (save_baseline, output)):
+        path.write_text(json.dumps(report, indent=2) + "\n")
+        typer.echo(f"Report written to {path}")
+    if baseline is not None:
+        regressions = compare(report, json.loads(baseline.read_text()), tolerance)
+        if regressions:
+            typer.echo("Regressions against baseline:")
+            for line in regressions:
+                typer.echo(f"  {line}")
+            sys.exit(1)
+        typer.echo("No regressions against baseline")
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,99 @@
+"""Operational commands for the Quran Learning API.
+
+Run from the backend directory, e.g. ``python manage.py ingest-corpus``.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+import typer
+
+import server
+
+cli = typer.Typer(help="Quran Learning API management commands")
+
+async def _with_upstream(coro):
+    """Run a coroutine with the shared Quran.com client pool open"""
+    await server.quran_api.start()
+    try:
+        return await coro
+    finally:
+        await server.quran_api.close()
+
+@cli.command("ingest-corpus")
+def ingest_corpus(concurrency: int = typer.Option(4, help="Chapters fetched in parallel")):
+    """Download all 114 chapters from Quran.com into the local corpus store."""
+    async def run():
+        await server.create_indexes()
+        counts = await server.ingest_quran_corpus(concurrency=concurrency)
+        # Running servers reload the rewritten index file on their next check
+        index = await server.build_search_index()
+        if index is not None:
+            index.save(server.SEARCH_INDEX_PATH)
+        return counts, index
+    
+    counts, index = asyncio.run(_with_upstream(run()))
+    typer.echo(f"Ingested {len(counts)} chapters, {sum(counts.values())} verses")
+    if index is not None:
+        typer.echo(f"Rebuilt the search index at {server.SEARCH_INDEX_PATH}")
+
+@cli.command("migrate-progress")
+def migrate_progress(batch_size: int = typer.Option(500, help="Users written per bulk_write")):
+    """Build per-user progress bitmaps from the user_progress collection."""
+    async def run():
+        await server.create_indexes()
+        return await server.migrate_progress_to_bitmaps(batch_size=batch_size)
+    
+    migrated = asyncio.run(run())
+    typer.echo(f"Migrated progress for {migrated} users")
+
+@cli.command("backfill-analytics")
+def backfill_analytics(
+    user_id: Optional[str] = typer.Option(None, help="Only rebuild this user's rollups"),
+    batch_size: int = typer.Option(500, help="Users written per bulk_write")
+):
+    """Rebuild daily learning rollups and streaks from learning_sessions."""
+    async def run():
+        await server.create_indexes()
+        return await server.backfill_daily_rollups(user_id=user_id, batch_size=batch_size)
+    
+    counts = asyncio.run(run())
+    typer.echo(f"Rebuilt {counts['rollups']} daily rollups and streaks for {counts['users']} users")
+
+@cli.command("build-bundles")
+def build_bundles(
+    reciters: str = typer.Option(",".join(server.BUNDLE_RECITERS), help="Comma-separated recitation ids"),
+    concurrency: int = typer.Option(4, help="Bundles built in parallel")
+):
+    """Build content-hashed offline chapter bundles and their manifest."""
+    reciter_ids = [server.normalize_reciter_id(r.strip()) for r in reciters.split(",") if r.strip()]
+    
+    async def run():
+        return await server.build_bundles(reciter_ids, concurrency=concurrency)
+    
+    try:
+        manifest = asyncio.run(_with_upstream(run()))
+    except RuntimeError as e:
+        typer.echo(f"{e}; run ingest-corpus first", err=True)
+        raise typer.Exit(code=1)
+    count = sum(len(entries) for entries in manifest["bundles"].values())
+    typer.echo(f"Wrote {count} bundles and manifest to {server.BUNDLE_DIR}")
+
+@cli.command("build-search-index")
+def build_search_index():
+    """Build the verse search index from the local corpus and save it to disk."""
+    async def run():
+        index = await server.build_search_index()
+        if index is not None:
+            index.save(server.SEARCH_INDEX_PATH)
+        return index
+    
+    index = asyncio.run(run())
+    if index is None:
+        typer.echo("Corpus is incomplete; run ingest-corpus first", err=True)
+        raise typer.Exit(code=1)
+    typer.echo(f"Indexed {len(index.docs)} verses into {server.SEARCH_INDEX_PATH}")
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    cli()
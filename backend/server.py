@@ -1,42 +1,238 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from bson.int64 import Int64
+import numpy as np
 import os
+import asyncio
+import atexit
+import base64
+import contextvars
+import copy
+import gzip
+import hashlib
+import heapq
+import hmac
+import json
 import logging
+import math
+import mimetypes
+import queue
+import random
+import unicodedata
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, validator
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 import jwt
 import bcrypt
 import httpx
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left, insort
+from collections import defaultdict, deque, OrderedDict
+from time import time, monotonic
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import stripe
 import re
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics
+# A small Prometheus-compatible registry. Observations are a dict lookup plus a
+# few additions; the lock only matters for pymongo listeners, which Motor runs
+# on its worker threads.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names + extra[:1], values + extra[1:])]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name, self.help, self.labelnames = name, help_text, labelnames
+        self.values: Dict[tuple, float] = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self.lock:
+            self.values[labels] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help_text, labelnames, buckets
+        self.series: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in list(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[Any] = []
+        self.collectors: List[Any] = []
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge_collector(self, name: str, help_text: str, labelnames: tuple, collect):
+        """Register a gauge whose samples are read from `collect()` at scrape time"""
+        self.collectors.append((name, help_text, labelnames, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for name, help_text, labelnames, collect in self.collectors:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+            try:
+                for labels, value in collect():
+                    lines.append(f"{name}{format_labels(labelnames, labels)} {value}")
+            except Exception as e:
+                logging.error(f"Error collecting metric {name}: {e}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+http_requests_total = metrics.counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = metrics.histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+upstream_request_duration = metrics.histogram(
+    "upstream_request_duration_seconds", "Quran.com request latency", ("endpoint", "outcome")
+)
+mongo_command_duration = metrics.histogram("mongo_command_duration_seconds", "MongoDB command latency", ("command", "outcome"))
+mongo_pool_wait = metrics.histogram(
+    "mongo_pool_wait_seconds", "Time waiting to check out a MongoDB connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+cpu_pool_wait = metrics.histogram("cpu_pool_wait_seconds", "Time queued for a CPU worker", ("pool",))
+cpu_pool_run = metrics.histogram("cpu_pool_run_seconds", "CPU work duration (bcrypt etc.)", ("pool",))
+stripe_request_duration = metrics.histogram("stripe_request_duration_seconds", "Stripe API latency", ("operation", "outcome"))
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records every Motor/pymongo command's latency"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name, "ok")
+
+    def failed(self, event):
+        mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name, "error")
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Measures connection checkout wait; start and finish happen on the same thread"""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self.local.started = monotonic()
+
+    def connection_checked_out(self, event):
+        started = getattr(self.local, "started", None)
+        if started is not None:
+            mongo_pool_wait.observe(monotonic() - started)
+            self.local.started = None
+
+    def connection_check_out_failed(self, event):
+        self.local.started = None
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_checked_in(self, event): pass
+
 # MongoDB connection with connection pooling
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url, maxPoolSize=50, minPoolSize=10, serverSelectionTimeoutMS=5000)
+client = AsyncIOMotorClient(
+    mongo_url, maxPoolSize=50, minPoolSize=10, serverSelectionTimeoutMS=5000,
+    event_listeners=[MongoCommandMetrics(), MongoPoolMetrics()]
+)
 db = client[os.environ['DB_NAME']]
 
 # Create indexes for better performance
-async def create_indexes():
-    """Create database indexes for better performance"""
+async def create_indexes() -> bool:
+    """Create database indexes for better performance; returns whether all succeeded"""
     try:
         await db.users.create_index([("email", 1)], unique=True)
         await db.users.create_index([("experience_points", -1)])
-        await db.learning_sessions.create_index([("user_id", 1), ("created_at", -1)])
+        await db.users.create_index([("is_active", 1), ("experience_points", -1)])
+        await db.users.create_index([("last_activity", 1)])
+        await db.learning_sessions.create_index([("user_id", 1), ("created_at", -1), ("id", -1)])
+        await db.learning_sessions.create_index([("created_at", -1)])
         await db.user_progress.create_index([("user_id", 1), ("surah_number", 1), ("ayah_number", 1)], unique=True)
+        await db.user_progress_bitmaps.create_index([("user_id", 1)], unique=True)
+        await db.learning_daily.create_index([("user_id", 1), ("date", 1)], unique=True)
+        await db.learning_daily.create_index([("date", 1)])
+        await db.stripe_events.create_index([("status", 1), ("received_at", 1)])
+        await db.stripe_events.create_index([("expires_at", 1)], expireAfterSeconds=0)
+        await db.shared_cache.create_index([("expires_at", 1)], expireAfterSeconds=0)
+        await db.rate_limits.create_index([("expires_at", 1)], expireAfterSeconds=0)
+        await db.quran_chapters.create_index([("id", 1)], unique=True)
+        await db.quran_verses.create_index([("chapter_id", 1), ("verse_number", 1)], unique=True)
         logging.info("Database indexes created successfully")
+        return True
     except Exception as e:
         logging.error(f"Error creating indexes: {e}")
+        readiness["last_error"] = f"indexes: {e}"
+        return False
+
+# Worker readiness: only ready once indexes exist and caches are warm
+readiness: Dict[str, Any] = {
+    "indexes": False,
+    "warmup": False,
+    "warmup_seconds": None,
+    "last_error": None
+}
 
 # Create the main app without a prefix
 app = FastAPI(
@@ -56,22 +252,189 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 
 # Initialize Stripe
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
+# Point at a local stand-in such as stripe-mock (http://localhost:12111) in development and tests
+if os.environ.get('STRIPE_API_BASE'):
+    stripe.api_base = os.environ['STRIPE_API_BASE']
+stripe.max_network_retries = int(os.environ.get('STRIPE_MAX_NETWORK_RETRIES', 2))
 
-# Rate limiting (basic implementation)
-from collections import defaultdict
-from time import time
-request_counts = defaultdict(list)
+# Rate limiting
+# Sliding-window counters: each key keeps only the current and previous window
+# counts, and the previous window is weighted by how much of it still overlaps.
+# Clients are keyed by address; behind a load balancer set TRUST_PROXY_HEADERS,
+# or every client shares the balancer's address. Probes and the Stripe webhook
+# (signed, and retried by Stripe on 429) are exempt.
 
-def check_rate_limit(client_ip: str, max_requests: int = 100, window_seconds: int = 3600):
-    """Basic rate limiting"""
-    now = time()
-    # Clean old requests
-    request_counts[client_ip] = [req_time for req_time in request_counts[client_ip] if now - req_time < window_seconds]
-    
-    if len(request_counts[client_ip]) >= max_requests:
-        raise HTTPException(status_code=429, detail="Too many requests")
-    
-    request_counts[client_ip].append(now)
+class LocalRateLimitBackend:
+    """Per-process window counters with periodic eviction of idle keys"""
+
+    def __init__(self, evict_interval: float = 60.0):
+        self._windows: Dict[str, list] = {}  # key -> [window_index, current, previous, window_seconds]
+        self.evict_interval = evict_interval
+        self._last_eviction = time()
+
+    async def increment(self, key: str, window_seconds: int, now: float):
+        """Count one request and return (current, previous) window counts"""
+        window_index = int(now // window_seconds)
+        state = self._windows.get(key)
+        if state is None or state[0] < window_index - 1:
+            state = [window_index, 0, 0, window_seconds]
+            self._windows[key] = state
+        elif state[0] == window_index - 1:
+            state[0], state[1], state[2] = window_index, 0, state[1]
+        state[1] += 1
+        if now - self._last_eviction > self.evict_interval:
+            self.evict_idle(now)
+        return state[1], state[2]
+
+    def evict_idle(self, now: float):
+        """Drop keys whose windows can no longer affect a decision"""
+        self._last_eviction = now
+        stale = [
+            key for key, (window_index, _, _, window_seconds) in self._windows.items()
+            if window_index < int(now // window_seconds) - 1
+        ]
+        for key in stale:
+            del self._windows[key]
+
+    def size(self) -> int:
+        return len(self._windows)
+
+class MongoRateLimitBackend:
+    """Window counters in a shared collection so limits hold across workers.
+    Expired windows are removed by a TTL index on expires_at."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def increment(self, key: str, window_seconds: int, now: float):
+        """Count one request and return (current, previous) window counts"""
+        window_index = int(now // window_seconds)
+        expires_at = datetime.utcfromtimestamp((window_index + 2) * window_seconds)
+        current, previous = await asyncio.gather(
+            self.collection.find_one_and_update(
+                {"_id": f"{key}:{window_index}"},
+                {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": expires_at}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            ),
+            self.collection.find_one({"_id": f"{key}:{window_index - 1}"})
+        )
+        return current["count"], (previous or {}).get("count", 0)
+
+    def size(self) -> int:
+        return -1
+
+class RateLimitPolicy(BaseModel):
+    name: str
+    path_prefix: str
+    limit: int
+    window_seconds: int
+
+def parse_rate_limit(spec: str):
+    """Parse a '<limit>/<seconds>' spec"""
+    limit, window = spec.split("/")
+    return int(limit), int(window)
+
+def load_rate_limit_policies() -> List[RateLimitPolicy]:
+    """Per-route policies from RATE_LIMIT_POLICIES, most specific prefix first"""
+    specs = os.environ.get(
+        'RATE_LIMIT_POLICIES',
+        '/api/auth/login=10/60,/api/auth/register=5/60,/api/create-payment-intent=10/60'
+    )
+    policies = []
+    for item in filter(None, (part.strip() for part in specs.split(","))):
+        prefix, spec = item.split("=")
+        limit, window = parse_rate_limit(spec)
+        policies.append(RateLimitPolicy(name=prefix, path_prefix=prefix, limit=limit, window_seconds=window))
+    limit, window = parse_rate_limit(os.environ.get('RATE_LIMIT_DEFAULT', '300/60'))
+    policies.append(RateLimitPolicy(name="default", path_prefix="/api", limit=limit, window_seconds=window))
+    return sorted(policies, key=lambda policy: len(policy.path_prefix), reverse=True)
+
+class RateLimiter:
+    """Applies the first matching policy to each (policy, client) key"""
+
+    def __init__(self, backend, policies: List[RateLimitPolicy], exempt_paths: tuple = ()):
+        self.backend = backend
+        self.policies = policies
+        self.exempt_paths = exempt_paths
+        self.limited_total = 0
+
+    def policy_for(self, path: str) -> Optional[RateLimitPolicy]:
+        if path.startswith(self.exempt_paths):
+            return None
+        return next((policy for policy in self.policies if path.startswith(policy.path_prefix)), None)
+
+    async def check(self, policy: RateLimitPolicy, client_id: str) -> Optional[int]:
+        """Count a request; returns seconds to wait if the client is over the limit"""
+        now = time()
+        current, previous = await self.backend.increment(f"{policy.name}:{client_id}", policy.window_seconds, now)
+        elapsed = (now % policy.window_seconds) / policy.window_seconds
+        estimated = previous * (1 - elapsed) + current
+        if estimated > policy.limit:
+            self.limited_total += 1
+            return max(1, int(policy.window_seconds * (1 - elapsed)))
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "tracked_keys": self.backend.size(),
+            "limited_total": self.limited_total,
+            "policies": [policy.dict() for policy in self.policies],
+        }
+
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', 'false').lower() == 'true'
+TRUSTED_PROXY_HOPS = max(1, int(os.environ.get('TRUSTED_PROXY_HOPS', 1)))
+
+def client_address(scope) -> str:
+    """Client IP, honouring X-Forwarded-For only behind a trusted proxy"""
+    if TRUST_PROXY_HEADERS:
+        # Proxies append, so only the rightmost TRUSTED_PROXY_HOPS entries are
+        # trustworthy; anything further left can be set by the client
+        forwarded = [
+            entry.strip()
+            for name, value in scope.get("headers", []) if name == b"x-forwarded-for"
+            for entry in value.decode("latin-1").split(",") if entry.strip()
+        ]
+        if forwarded:
+            return forwarded[-min(TRUSTED_PROXY_HOPS, len(forwarded))]
+    client_info = scope.get("client")
+    return client_info[0] if client_info else "unknown"
+
+class RateLimitMiddleware:
+    """ASGI middleware enforcing the rate limiter's per-route policies"""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        policy = self.limiter.policy_for(scope["path"])
+        if policy is not None:
+            try:
+                retry_after = await self.limiter.check(policy, client_address(scope))
+            except Exception as e:
+                # Fail open: a broken limiter backend must not take the API down
+                logging.error(f"Rate limiter error: {e}")
+                retry_after = None
+            if retry_after is not None:
+                response = JSONResponse(
+                    {"detail": "Too many requests"},
+                    status_code=429,
+                    headers={"Retry-After": str(retry_after)}
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+if os.environ.get('RATE_LIMIT_BACKEND', 'local') == 'mongo':
+    rate_limit_backend = MongoRateLimitBackend(db.rate_limits)
+else:
+    rate_limit_backend = LocalRateLimitBackend()
+rate_limiter = RateLimiter(rate_limit_backend, load_rate_limit_policies(), exempt_paths=("/api/live", "/api/health", "/api/ready", "/api/stripe-webhook"))
 
 # Validation functions
 def validate_email(email: str) -> bool:
@@ -114,6 +477,8 @@ class User(BaseModel):
     current_surah: int = Field(default=1, ge=1, le=114)
     current_ayah: int = Field(default=1, ge=1)
     streak_days: int = Field(default=0, ge=0)
+    longest_streak: int = Field(default=0, ge=0)
+    last_active_date: Optional[str] = None
     last_activity: datetime = Field(default_factory=datetime.utcnow)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     preferred_reciter: str = Field(default="7")
@@ -159,6 +524,19 @@ class LearningSessionCreate(BaseModel):
     session_type: str = Field(regex=r'^(reading|memorization|translation|recitation)$')
     duration_minutes: int = Field(ge=1, le=300)
 
+class OfflineLearningSession(LearningSessionCreate):
+    recorded_at: Optional[datetime] = None
+
+    @validator("recorded_at")
+    def naive_utc(cls, value):
+        """Stored timestamps are naive UTC; clients usually send ISO strings with Z"""
+        if value is not None and value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+class LearningSessionBatch(BaseModel):
+    sessions: List[OfflineLearningSession] = Field(min_items=1, max_items=500)
+
 class UserProgressCreate(BaseModel):
     surah_number: int = Field(ge=1, le=114)
     ayah_number: int = Field(ge=1)
@@ -166,6 +544,20 @@ class UserProgressCreate(BaseModel):
     experience_gained: int = Field(default=0, ge=0)
     difficulty_level: DifficultyLevel
 
+class ProgressRange(BaseModel):
+    surah_number: int = Field(ge=1, le=114)
+    start_ayah: int = Field(ge=1)
+    end_ayah: int = Field(ge=1)
+    completed: bool = True
+    experience_gained: int = Field(default=0, ge=0)
+    difficulty_level: DifficultyLevel
+
+MAX_PROGRESS_BATCH = 1000
+
+class UserProgressBatch(BaseModel):
+    items: Optional[List[UserProgressCreate]] = Field(default=None, max_items=MAX_PROGRESS_BATCH)
+    range: Optional[ProgressRange] = None
+
 class QuranVerse(BaseModel):
     verse_number: int
     verse_key: str
@@ -183,15 +575,161 @@ class QuranChapter(BaseModel):
     difficulty_level: DifficultyLevel
     revelation_place: str
 
+# CPU-bound work pool
+class CPUWorkPool:
+    """Runs blocking calls on a bounded thread pool so they never stall the
+    event loop. bcrypt and socket I/O release the GIL, so threads scale here."""
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.semaphore = asyncio.Semaphore(max_workers)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    async def run(self, func, *args):
+        """Run func(*args) on the pool, raising 503 when the queue is full"""
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, please retry")
+        queued_at = monotonic()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started_at = monotonic()
+        self.total_wait_seconds += started_at - queued_at
+        cpu_pool_wait.observe(started_at - queued_at, self.name)
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            elapsed = monotonic() - started_at
+            self.running -= 1
+            self.completed += 1
+            self.total_run_seconds += elapsed
+            self.max_run_seconds = max(self.max_run_seconds, elapsed)
+            cpu_pool_run.observe(elapsed, self.name)
+            self.semaphore.release()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and latency counters"""
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(1000 * self.total_wait_seconds / self.completed, 2) if self.completed else 0.0,
+            "avg_run_ms": round(1000 * self.total_run_seconds / self.completed, 2) if self.completed else 0.0,
+            "max_run_ms": round(1000 * self.max_run_seconds, 2),
+        }
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+auth_pool = CPUWorkPool(
+    "auth",
+    max_workers=int(os.environ.get('AUTH_POOL_WORKERS', 4)),
+    max_queue=int(os.environ.get('AUTH_POOL_MAX_QUEUE', 256))
+)
+# The Stripe SDK is synchronous; its network round trips run here instead of on the loop
+stripe_pool = CPUWorkPool(
+    "stripe",
+    max_workers=int(os.environ.get('STRIPE_POOL_WORKERS', 8)),
+    max_queue=int(os.environ.get('STRIPE_POOL_MAX_QUEUE', 64))
+)
+
 # Helper functions
 def hash_password(password: str) -> str:
-    """Hash password securely"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """Hash password securely (blocking; call through auth_pool)"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
-    """Verify password against hash"""
+    """Verify password against hash (blocking; call through auth_pool)"""
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def calculate_session_xp(session_type: str, duration_minutes: int) -> int:
+    """Experience points based on session type and duration"""
+    base_xp = 10
+    if session_type == "memorization":
+        base_xp = 20
+    elif session_type == "recitation":
+        base_xp = 15
+    return base_xp * duration_minutes
+
+def experience_update(experience_gained: int, now: datetime) -> List[Dict[str, Any]]:
+    """Update pipeline that adds XP and derives the level server-side, atomically"""
+    return [
+        {"$set": {
+            "experience_points": {"$add": [{"$ifNull": ["$experience_points", 0]}, experience_gained]},
+            "last_activity": now
+        }},
+        {"$set": {
+            "level": {"$add": [{"$floor": {"$divide": ["$experience_points", 100]}}, 1]}
+        }}
+    ]
+
+def day_key(moment: datetime) -> str:
+    """UTC calendar day as YYYY-MM-DD; these keys sort chronologically as strings"""
+    return moment.strftime("%Y-%m-%d")
+
+def streak_update(active_days: List[str]) -> List[Dict[str, Any]]:
+    """Update pipeline stages that extend the user's streak for each active day.
+
+    Each day costs O(1): activity on the day after `last_active_date` extends
+    the streak, a later day restarts it, and days already counted (or older,
+    e.g. late offline uploads) leave it unchanged until the next backfill."""
+    stages = []
+    for day in sorted(set(active_days)):
+        previous = day_key(datetime.strptime(day, "%Y-%m-%d") - timedelta(days=1))
+        last_active = {"$ifNull": ["$last_active_date", ""]}
+        streak = {"$ifNull": ["$streak_days", 0]}
+        stages.append({"$set": {
+            "streak_days": {"$switch": {
+                "branches": [
+                    {"case": {"$gte": [last_active, day]}, "then": streak},
+                    {"case": {"$eq": [last_active, previous]}, "then": {"$add": [streak, 1]}}
+                ],
+                "default": 1
+            }},
+            "last_active_date": {"$max": [last_active, day]}
+        }})
+    if stages:
+        stages.append({"$set": {"longest_streak": {"$max": [{"$ifNull": ["$longest_streak", 0]}, "$streak_days"]}}})
+    return stages
+
+def current_streak(user: User, today: Optional[date] = None) -> int:
+    """The stored streak, or 0 once a full day has passed without activity"""
+    if not user.last_active_date:
+        return 0
+    today = today or datetime.utcnow().date()
+    if user.last_active_date < (today - timedelta(days=1)).isoformat():
+        return 0
+    return user.streak_days
+
+async def apply_experience(user_id: str, experience_gained: int, active_days: List[str] = ()):
+    """Credit XP (and streak days) to a user, drop their cached principal and update the leaderboard"""
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        experience_update(experience_gained, datetime.utcnow()) + streak_update(list(active_days)),
+        projection=LEADERBOARD_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    principal_cache.invalidate(user_id)
+    if user and user.get("is_active", True):
+        leaderboard.record(user, experience_gained)
+
 def create_access_token(data: dict):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -200,6 +738,19 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
     return encoded_jwt
 
+# Authenticated principals are cached briefly so most requests skip Mongo.
+# Write paths that change user state call principal_cache.invalidate(user_id);
+# the short TTL bounds staleness for writes made by other workers.
+PRINCIPAL_PROJECTION = {"_id": 0, "password_hash": 0}
+
+async def load_principal(user_id: str) -> Optional[User]:
+    """Fetch an active user without the password hash"""
+    user = await db.users.find_one({"id": user_id, "is_active": True}, PRINCIPAL_PROJECTION)
+    if user is None:
+        return None
+    # Trusted data we wrote ourselves, so skip re-validation
+    return User.construct(password_hash="", **user)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current authenticated user"""
     try:
@@ -207,152 +758,2405 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user_id: str = payload.get("user_id")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id, "is_active": True})
+        user = await principal_cache.get_or_load(user_id, lambda: load_principal(user_id))
         if user is None:
             raise HTTPException(status_code=401, detail="User not found or inactive")
-        # Remove MongoDB _id field to avoid serialization issues
-        user.pop("_id", None)
-        return User(**user)
+        return user
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-# Quran API integration with caching
-cached_chapters = None
-cache_timestamp = None
-CACHE_DURATION = 3600  # 1 hour
+# Operational endpoints (pool, cache and limiter stats) need the X-Admin-Token
+# header; without ADMIN_API_TOKEN configured they do not exist.
+ADMIN_API_TOKEN = os.environ.get('ADMIN_API_TOKEN', '')
+
+async def require_admin(request: Request):
+    """Reject requests without the configured admin token"""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), ADMIN_API_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# Shared upstream HTTP client pool for Quran.com
+QURAN_API_BASE = os.environ.get('QURAN_API_BASE', 'https://api.quran.com/api/v4')
+QURAN_AUDIO_BASE = os.environ.get('QURAN_AUDIO_BASE', 'https://verses.quran.com')
+
+UPSTREAM_TIMEOUTS = {
+    "chapters": float(os.environ.get('QURAN_TIMEOUT_CHAPTERS', 10.0)),
+    "verses": float(os.environ.get('QURAN_TIMEOUT_VERSES', 15.0)),
+    "recitations": float(os.environ.get('QURAN_TIMEOUT_RECITATIONS', 10.0)),
+}
+
+# Upstream resilience: per-endpoint circuit breakers, retries bounded by a
+# shared budget, and hedged requests for tail latency. A call never runs past
+# its endpoint timeout, and an open breaker fails fast so callers fall back to
+# cached content instead of waiting on a struggling upstream.
+UPSTREAM_MAX_RETRIES = int(os.environ.get('QURAN_MAX_RETRIES', 2))
+UPSTREAM_RETRY_BASE_DELAY = float(os.environ.get('QURAN_RETRY_BASE_DELAY', 0.1))
+UPSTREAM_RETRY_MAX_DELAY = float(os.environ.get('QURAN_RETRY_MAX_DELAY', 1.0))
+UPSTREAM_RETRY_BUDGET_RATIO = float(os.environ.get('QURAN_RETRY_BUDGET_RATIO', 0.2))
+UPSTREAM_RETRY_BUDGET_MIN = float(os.environ.get('QURAN_RETRY_BUDGET_MIN', 10))
+UPSTREAM_HEDGING = os.environ.get('QURAN_HEDGING', 'true').lower() == 'true'
+UPSTREAM_HEDGE_MIN_DELAY = float(os.environ.get('QURAN_HEDGE_MIN_DELAY', 0.3))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('QURAN_BREAKER_FAILURES', 5))
+BREAKER_OPEN_SECONDS = float(os.environ.get('QURAN_BREAKER_OPEN_SECONDS', 30))
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class UpstreamUnavailable(Exception):
+    """Raised without contacting Quran.com while an endpoint's breaker is open"""
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open probe -> closed"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int, open_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.opened_total = 0
+        self.short_circuited = 0
+
+    def allow(self) -> bool:
+        """Whether a request may go upstream now"""
+        now = monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.open_seconds:
+                self.short_circuited += 1
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_started = 0.0
+        if self.state == self.HALF_OPEN:
+            # One probe at a time; a probe that never reports frees the slot after open_seconds
+            if self.probe_started and now - self.probe_started < self.open_seconds:
+                self.short_circuited += 1
+                return False
+            self.probe_started = now
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logging.info(f"Circuit for {self.name} closed")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.probe_started = 0.0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold
+        ):
+            if self.state == self.CLOSED:
+                logging.warning(f"Circuit for {self.name} opened after {self.consecutive_failures} failures")
+            self.state = self.OPEN
+            self.opened_at = monotonic()
+            self.opened_total += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened_total": self.opened_total,
+            "short_circuited": self.short_circuited,
+            "retry_after": round(max(0.0, self.opened_at + self.open_seconds - monotonic()), 1)
+            if self.state == self.OPEN else 0.0,
+        }
+
+class RetryBudget:
+    """Token bucket shared by retries and hedges: every request deposits `ratio`
+    tokens, each extra attempt spends one, so extra load stays a bounded
+    fraction of real traffic when the upstream is failing"""
+
+    def __init__(self, ratio: float, minimum: float):
+        self.ratio = ratio
+        self.capacity = max(minimum, 1.0)
+        self.tokens = self.capacity
+        self.exhausted = 0
+
+    def deposit(self):
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+class UpstreamClientPool:
+    """App-scoped httpx client shared by every Quran.com call"""
+
+    def __init__(self, base_url: str, max_connections: int = 100, max_keepalive: int = 20,
+                 keepalive_expiry: float = 30.0, http2: bool = False, connect_timeout: float = 5.0):
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http2 = http2
+        self.connect_timeout = connect_timeout
+        self.client: Optional[httpx.AsyncClient] = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests_total = 0
+        self.errors_total = 0
+        self.requests_by_endpoint: Dict[str, int] = defaultdict(int)
+        self.retries_total = 0
+        self.hedges_total = 0
+        self.hedge_wins = 0
+        self.breakers = {
+            endpoint: CircuitBreaker(endpoint, BREAKER_FAILURE_THRESHOLD, BREAKER_OPEN_SECONDS)
+            for endpoint in UPSTREAM_TIMEOUTS
+        }
+        self.retry_budget = RetryBudget(UPSTREAM_RETRY_BUDGET_RATIO, UPSTREAM_RETRY_BUDGET_MIN)
+        self.latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=200))
+
+    async def start(self):
+        """Open the shared client (idempotent)"""
+        if self.client is not None:
+            return
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logging.warning("QURAN_HTTP2 requested but the 'h2' package is not installed; using HTTP/1.1")
+                http2 = False
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=self.limits,
+            http2=http2,
+            timeout=httpx.Timeout(UPSTREAM_TIMEOUTS["chapters"], connect=self.connect_timeout)
+        )
+
+    async def close(self):
+        """Close the shared client and release pooled connections"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(endpoint, BREAKER_FAILURE_THRESHOLD, BREAKER_OPEN_SECONDS)
+        return self.breakers[endpoint]
+
+    async def get(self, endpoint: str, path: str, **kwargs) -> httpx.Response:
+        """GET a Quran.com path within the endpoint's timeout, retrying transient
+        failures and hedging slow attempts; raises UpstreamUnavailable while the
+        endpoint's breaker is open"""
+        if self.client is None:
+            await self.start()
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise UpstreamUnavailable(f"Circuit open for Quran.com {endpoint}")
+        self.retry_budget.deposit()
+        deadline = monotonic() + UPSTREAM_TIMEOUTS.get(endpoint, UPSTREAM_TIMEOUTS["chapters"])
+        response: Optional[httpx.Response] = None
+        error: Optional[Exception] = None
+        
+        for attempt in range(UPSTREAM_MAX_RETRIES + 1):
+            if attempt:
+                # Full jitter keeps retries from many workers from synchronising
+                backoff = random.uniform(0, min(UPSTREAM_RETRY_MAX_DELAY, UPSTREAM_RETRY_BASE_DELAY * 2 ** attempt))
+                if deadline - monotonic() <= backoff or not self.retry_budget.withdraw():
+                    break
+                self.retries_total += 1
+                await asyncio.sleep(backoff)
+                if not breaker.allow():
+                    break
+            try:
+                response = await self._hedged(endpoint, path, deadline, kwargs)
+                error = None
+            except (httpx.TransportError, asyncio.TimeoutError) as e:
+                response, error = None, e
+                breaker.record_failure()
+                continue
+            if response.status_code in RETRYABLE_STATUS:
+                breaker.record_failure()
+                continue
+            breaker.record_success()
+            return response
+        
+        if response is not None:
+            return response
+        raise error or UpstreamUnavailable(f"Circuit open for Quran.com {endpoint}")
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """Send a backup request once an attempt is slower than the endpoint's recent p95"""
+        samples = self.latencies[endpoint]
+        if not UPSTREAM_HEDGING or len(samples) < 20:
+            return None
+        ordered = sorted(samples)
+        return max(UPSTREAM_HEDGE_MIN_DELAY, ordered[int(len(ordered) * 0.95) - 1])
+
+    async def _hedged(self, endpoint: str, path: str, deadline: float, kwargs) -> httpx.Response:
+        first = asyncio.ensure_future(self._attempt(endpoint, path, deadline, kwargs))
+        delay = self.hedge_delay(endpoint)
+        if delay is None or deadline - monotonic() <= delay:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or not self.retry_budget.withdraw():
+            return await first
+        
+        self.hedges_total += 1
+        hedge = asyncio.ensure_future(self._attempt(endpoint, path, deadline, kwargs))
+        pending = {first, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code not in RETRYABLE_STATUS:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Both attempts failed; surface the original one
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _attempt(self, endpoint: str, path: str, deadline: float, kwargs) -> httpx.Response:
+        remaining = max(0.001, deadline - monotonic())
+        timeout = httpx.Timeout(remaining, connect=min(remaining, self.connect_timeout))
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.requests_total += 1
+        self.requests_by_endpoint[endpoint] += 1
+        started = monotonic()
+        outcome = "error"
+        try:
+            response = await self.client.get(path, timeout=timeout, **kwargs)
+            outcome = f"{response.status_code // 100}xx"
+            if response.status_code < 500:
+                self.latencies[endpoint].append(monotonic() - started)
+            return response
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            self.errors_total += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            upstream_request_duration.observe(monotonic() - started, endpoint, outcome)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool statistics used to size the connection limits"""
+        connections = []
+        if self.client is not None:
+            # httpx does not expose pool state publicly; read it defensively
+            pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []) or [])
+        idle = sum(1 for conn in connections if getattr(conn, "is_idle", lambda: False)())
+        return {
+            "open": self.client is not None,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "connections": len(connections),
+            "idle_connections": idle,
+            "active_connections": len(connections) - idle,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "requests_total": self.requests_total,
+            "errors_total": self.errors_total,
+            "requests_by_endpoint": dict(self.requests_by_endpoint),
+            "timeouts": UPSTREAM_TIMEOUTS,
+            "retries_total": self.retries_total,
+            "hedges_total": self.hedges_total,
+            "hedge_wins": self.hedge_wins,
+            "retry_budget_tokens": round(self.retry_budget.tokens, 2),
+            "retry_budget_exhausted": self.retry_budget.exhausted,
+            "hedge_delays": {endpoint: self.hedge_delay(endpoint) for endpoint in self.breakers},
+            "breakers": self.breaker_states(),
+        }
+
+    def breaker_states(self) -> Dict[str, Dict[str, Any]]:
+        return {endpoint: breaker.stats() for endpoint, breaker in self.breakers.items()}
+
+quran_api = UpstreamClientPool(
+    QURAN_API_BASE,
+    max_connections=int(os.environ.get('QURAN_HTTP_MAX_CONNECTIONS', 100)),
+    max_keepalive=int(os.environ.get('QURAN_HTTP_MAX_KEEPALIVE', 20)),
+    keepalive_expiry=float(os.environ.get('QURAN_HTTP_KEEPALIVE_EXPIRY', 30.0)),
+    http2=os.environ.get('QURAN_HTTP2', 'false').lower() == 'true'
+)
+
+# Shared content cache tier
+# Upstream content fetched by one worker is written to a store every worker
+# can read, so a fresh worker fills its in-process cache from there instead of
+# from Quran.com. Keys carry SHARED_CACHE_VERSION so a format change can never
+# read entries written by older code; values must be JSON-compatible.
+SHARED_CACHE_BACKEND = os.environ.get('SHARED_CACHE_BACKEND', 'mongo')
+SHARED_CACHE_DIR = Path(os.environ.get('SHARED_CACHE_DIR', ROOT_DIR / 'data' / 'shared_cache'))
+SHARED_CACHE_TTL = int(os.environ.get('SHARED_CACHE_TTL', 7 * 86400))
+SHARED_CACHE_VERSION = os.environ.get('SHARED_CACHE_VERSION', '1')
+
+class MongoSharedCacheBackend:
+    """Entries in a Mongo collection expired by a TTL index on expires_at"""
+
+    def __init__(self, collection: str):
+        self.collection = collection
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        # The TTL monitor runs about once a minute, so filter on expiry too
+        docs = await db[self.collection].find(
+            {"_id": {"$in": keys}, "expires_at": {"$gt": datetime.utcnow()}},
+            {"value": 1}
+        ).to_list(len(keys))
+        return {doc["_id"]: doc["value"] for doc in docs}
+
+    async def set_many(self, items: Dict[str, Any], ttl: float):
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+        await db[self.collection].bulk_write([
+            ReplaceOne({"_id": key}, {"value": value, "expires_at": expires_at}, upsert=True)
+            for key, value in items.items()
+        ], ordered=False)
+
+class FileSharedCacheBackend:
+    """One JSON file per key in a directory shared by the workers on a host;
+    a stand-in for deployments without a shared Mongo"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+
+    def _read(self, keys: List[str]) -> Dict[str, Any]:
+        found = {}
+        now = time()
+        for key in keys:
+            try:
+                entry = json.loads(self.path(key).read_text())
+            except (OSError, ValueError):
+                continue
+            if entry.get("key") == key and entry.get("expires_at", 0) > now:
+                found[key] = entry["value"]
+        return found
+
+    def _write(self, items: Dict[str, Any], ttl: float):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        expires_at = time() + ttl
+        for key, value in items.items():
+            target = self.path(key)
+            temp = target.with_suffix(f".{os.getpid()}.tmp")
+            temp.write_text(json.dumps({"key": key, "expires_at": expires_at, "value": value}))
+            # Atomic rename, so readers never see a partial file
+            os.replace(temp, target)
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        return await asyncio.get_running_loop().run_in_executor(None, self._read, keys)
+
+    async def set_many(self, items: Dict[str, Any], ttl: float):
+        await asyncio.get_running_loop().run_in_executor(None, self._write, items, ttl)
+
+class SharedContentCache:
+    """Versioned bulk get/set over a shared backend; failures count as misses"""
+
+    def __init__(self, backend, version: str, ttl: float):
+        self.backend = backend
+        self.version = version
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def key(self, namespace: str, key) -> str:
+        parts = key if isinstance(key, tuple) else (key,)
+        return ":".join([f"v{self.version}", namespace, *map(str, parts)])
+
+    async def get_many(self, namespace: str, keys: list) -> Dict[Any, Any]:
+        """Values for whichever of `keys` are present, keyed by the original key"""
+        if not keys:
+            return {}
+        names = {self.key(namespace, key): key for key in keys}
+        try:
+            found = await self.backend.get_many(list(names))
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Shared cache read failed: {e}")
+            found = {}
+        self.hits += len(found)
+        self.misses += len(names) - len(found)
+        return {names[name]: value for name, value in found.items()}
+
+    async def set_many(self, namespace: str, items: Dict[Any, Any]):
+        if not items:
+            return
+        try:
+            await self.backend.set_many({self.key(namespace, key): value for key, value in items.items()}, self.ttl)
+            self.writes += len(items)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Shared cache write failed: {e}")
+
+    async def get(self, namespace: str, key):
+        return (await self.get_many(namespace, [key])).get(key)
+
+    async def set(self, namespace: str, key, value):
+        await self.set_many(namespace, {key: value})
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": SHARED_CACHE_BACKEND,
+            "version": self.version,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+if SHARED_CACHE_BACKEND == "mongo":
+    shared_cache: Optional[SharedContentCache] = SharedContentCache(
+        MongoSharedCacheBackend("shared_cache"), SHARED_CACHE_VERSION, SHARED_CACHE_TTL
+    )
+elif SHARED_CACHE_BACKEND == "file":
+    shared_cache = SharedContentCache(FileSharedCacheBackend(SHARED_CACHE_DIR), SHARED_CACHE_VERSION, SHARED_CACHE_TTL)
+else:
+    shared_cache = None
+
+# In-process content cache
+class AsyncTTLCache:
+    """Bounded async cache with LRU eviction, TTL, stale-while-revalidate and
+    single-flight loading: concurrent misses for one key share a single load.
+    Empty results are not cached so transient upstream failures are retried.
+    Caches with a stale_ttl keep an expired entry as last-known-good when a
+    load fails or comes back empty; without one (e.g. principals, where None
+    means the user is gone) expired entries are never served.
+    With a `shared` tier, misses are looked up there before calling the loader
+    and loaded values are written back for other workers."""
+
+    def __init__(self, name: str, max_entries: int, ttl: float, stale_ttl: float = 0.0,
+                 shared: Optional[SharedContentCache] = None):
+        self.name = name
+        self.shared = shared
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._inflight: Dict[Any, asyncio.Future] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.loads = 0
+        self.load_errors = 0
+        self.fallback_hits = 0
+
+    async def get_or_load(self, key, loader):
+        """Return the cached value for `key`, calling `loader()` at most once on a miss"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = monotonic() - stored_at
+            if age < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            if age < self.ttl + self.stale_ttl:
+                # Serve stale and refresh in the background
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._start_load(key, loader)
+                return value
+        
+        self.misses += 1
+        try:
+            loaded = await asyncio.shield(self._start_load(key, loader))
+        except Exception:
+            if entry is None or not self.stale_ttl:
+                raise
+            loaded = None
+        if not loaded and entry is not None and self.stale_ttl:
+            # Upstream is failing; serve the last-known-good value
+            self.fallback_hits += 1
+            return entry[0]
+        return loaded
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries past the bound"""
+        self._entries[key] = (value, monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """Drop a single key; a load already in flight for it will not be cached,
+        since it may have read the value before the write that invalidated it"""
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def clear(self):
+        """Drop every entry"""
+        self._entries.clear()
+        self._inflight.clear()
+
+    def _start_load(self, key, loader) -> asyncio.Future:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return task
+        self.loads += 1
+        # The load runs as its own task so a cancelled caller doesn't cancel it for the others
+        task = asyncio.ensure_future(self._load(key, loader))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done, key=key: self._finish_load(key, done))
+        return task
+
+    async def _load(self, key, loader):
+        if self.shared is None:
+            return await loader()
+        value = await self.shared.get(self.name, key)
+        if value:
+            return value
+        value = await loader()
+        if value:
+            await self.shared.set(self.name, key, value)
+        return value
+
+    async def prefetch(self, keys: list) -> int:
+        """Fill missing keys from the shared tier in one round trip; returns how many were found"""
+        if self.shared is None:
+            return 0
+        missing = [key for key in keys if key not in self._entries]
+        found = await self.shared.get_many(self.name, missing)
+        for key, value in found.items():
+            if value:
+                self.set(key, value)
+        return len(found)
+
+    def _finish_load(self, key, task: asyncio.Future):
+        if self._inflight.get(key) is not task:
+            # Invalidated while loading
+            return
+        del self._inflight[key]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.load_errors += 1
+            return
+        value = task.result()
+        if value:
+            self.set(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counters"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "fallback_hits": self.fallback_hits,
+            "in_flight": len(self._inflight),
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+CACHE_DURATION = int(os.environ.get('CONTENT_CACHE_TTL', 3600))  # 1 hour
+CACHE_STALE_DURATION = int(os.environ.get('CONTENT_CACHE_STALE_TTL', 86400))
+DEFAULT_TRANSLATION_ID = "131"
+
+chapters_cache = AsyncTTLCache("chapters", max_entries=4, ttl=CACHE_DURATION, stale_ttl=CACHE_STALE_DURATION)
+verses_cache = AsyncTTLCache(
+    "verses",
+    max_entries=int(os.environ.get('VERSES_CACHE_SIZE', 512)),
+    ttl=CACHE_DURATION,
+    stale_ttl=CACHE_STALE_DURATION
+)
+# Chapters and verses are already shared through the Mongo corpus store; audio
+# indexes come only from Quran.com, so they use the shared tier
+audio_index_cache = AsyncTTLCache(
+    "audio_index",
+    max_entries=int(os.environ.get('AUDIO_INDEX_CACHE_SIZE', 1024)),
+    ttl=CACHE_DURATION,
+    stale_ttl=CACHE_STALE_DURATION,
+    shared=shared_cache
+)
+principal_cache = AsyncTTLCache(
+    "principals",
+    max_entries=int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('PRINCIPAL_CACHE_TTL', 30))
+)
+
+# Quran API integration
+async def fetch_quran_chapters():
+    """Fetch all Quran chapters from Quran.com API"""
+    try:
+        response = await quran_api.get("chapters", "/chapters")
+        if response.status_code == 200:
+            chapters_data = response.json()["chapters"]
+            # Add difficulty levels based on chapter length and complexity
+            chapters = []
+            for chapter in chapters_data:
+                if chapter["verses_count"] <= 10:
+                    difficulty = DifficultyLevel.BEGINNER
+                elif chapter["verses_count"] <= 50:
+                    difficulty = DifficultyLevel.INTERMEDIATE
+                else:
+                    difficulty = DifficultyLevel.ADVANCED
+                    
+                chapters.append(QuranChapter(
+                    id=chapter["id"],
+                    name_simple=chapter["name_simple"],
+                    name_arabic=chapter["name_arabic"],
+                    verses_count=chapter["verses_count"],
+                    difficulty_level=difficulty,
+                    revelation_place=chapter["revelation_place"]
+                ))
+            
+            return chapters
+    except UpstreamUnavailable as e:
+        logging.warning(str(e))
+    except Exception as e:
+        logging.error(f"Error fetching chapters: {e}")
+    
+    return []
+
+async def fetch_quran_verses(chapter_id: int, per_page: int = 50):
+    """Fetch every verse of a chapter from Quran.com, following pagination"""
+    if not (1 <= chapter_id <= 114):
+        raise HTTPException(status_code=400, detail="Invalid chapter ID")
+    
+    verses = []
+    page = 1
+    try:
+        while page:
+            # Fetch verses with translations and transliterations
+            verses_response = await quran_api.get(
+                "verses",
+                f"/verses/by_chapter/{chapter_id}",
+                params={
+                    "translations": DEFAULT_TRANSLATION_ID, 
+                    "words": "true", 
+                    "fields": "text_uthmani,text_simple",
+                    "per_page": per_page,
+                    "page": page
+                }
+            )
+            if verses_response.status_code != 200:
+                logging.error(f"Quran.com returned {verses_response.status_code} for chapter {chapter_id} page {page}")
+                return []
+            
+            data = verses_response.json()
+            for verse in data["verses"]:
+                # Get transliteration from words
+                transliteration = " ".join([
+                    word.get("transliteration", {}).get("text", "") or ""
+                    for word in verse.get("words", [])
+                    if word.get("transliteration", {}).get("text")
+                ])
+                
+                # Get translation (using first available translation)
+                translation = ""
+                if verse.get("translations"):
+                    translation = verse["translations"][0].get("text", "")
+                
+                verses.append(QuranVerse(
+                    verse_number=verse["verse_number"],
+                    verse_key=verse["verse_key"],
+                    text_uthmani=verse.get("text_uthmani", ""),
+                    text_simple=verse.get("text_simple", ""),
+                    translation=translation,
+                    transliteration=transliteration
+                ))
+            
+            page = (data.get("pagination") or {}).get("next_page")
+        
+        return verses
+    except UpstreamUnavailable as e:
+        logging.warning(str(e))
+    except Exception as e:
+        logging.error(f"Error fetching verses for chapter {chapter_id}: {e}")
+    
+    return []
+
+# Map old string IDs to numeric IDs
+RECITER_MAP = {
+    "ar.alafasy": "7",  # Mishary Rashid Alafasy
+    "ar.husary": "1",   # AbdulBaset AbdulSamad (Mujawwad)
+    "ar.minshawi": "2", # AbdulBaset AbdulSamad (Murattal)
+    "ar.muhammed": "3", # Abdur-Rahman as-Sudais
+    "ar.walk": "5"      # Hani ar-Rifai
+}
+
+def normalize_reciter_id(reciter: str) -> str:
+    """Convert legacy reciter strings to Quran.com recitation IDs"""
+    if reciter.startswith("ar."):
+        return RECITER_MAP.get(reciter, "1")
+    return reciter
+
+def audio_file_url(path: str) -> str:
+    """Absolute URL for a Quran.com audio file path"""
+    if path.startswith(("http://", "https://")):
+        return path
+    if path.startswith("//"):
+        return f"https:{path}"
+    return f"{QURAN_AUDIO_BASE}/{path.lstrip('/')}"
+
+async def fetch_audio_index(reciter_id: str, chapter_id: int) -> Dict[str, str]:
+    """Fetch a reciter's audio listing for a chapter as a verse_key -> url index"""
+    index: Dict[str, str] = {}
+    page = 1
+    try:
+        while page:
+            response = await quran_api.get(
+                "recitations",
+                f"/recitations/{reciter_id}/by_chapter/{chapter_id}",
+                params={"per_page": 50, "page": page}
+            )
+            if response.status_code != 200:
+                logging.error(f"Quran.com returned {response.status_code} for reciter {reciter_id} chapter {chapter_id}")
+                return {}
+            data = response.json()
+            for audio_file in data.get("audio_files", []):
+                if audio_file.get("verse_key") and audio_file.get("url"):
+                    index[audio_file["verse_key"]] = audio_file_url(audio_file["url"])
+            page = (data.get("pagination") or {}).get("next_page")
+    except UpstreamUnavailable as e:
+        logging.warning(str(e))
+        return {}
+    except Exception as e:
+        logging.error(f"Error fetching audio for reciter {reciter_id}, chapter {chapter_id}: {e}")
+        return {}
+    # A partial listing would be cached and map missing verses to the wrong audio
+    if len(index) < VERSE_COUNTS[chapter_id - 1]:
+        logging.warning(f"Incomplete audio listing for reciter {reciter_id} chapter {chapter_id}: {len(index)} of {VERSE_COUNTS[chapter_id - 1]} verses")
+        return {}
+    return index
+
+async def fetch_audio_url(chapter_id: int, verse_number: int, reciter: str = "1", base_url: Optional[str] = None):
+    """Audio URL for a specific verse, looked up in the cached chapter index"""
+    if not (1 <= chapter_id <= 114):
+        return None
+    
+    index = await load_audio_index(reciter, chapter_id)
+    if not index:
+        return None
+    # If specific verse not found, return the first audio file
+    return client_audio_url(index.get(f"{chapter_id}:{verse_number}") or next(iter(index.values())), base_url)
+
+# Local Quran corpus store
+# Chapters and verses are static, so they are ingested once into Mongo and
+# served from there; Quran.com is only consulted when the store is empty.
+MAX_VERSES_PER_PAGE = 286  # Al-Baqarah, the longest chapter
+
+async def store_chapters(chapters: List[QuranChapter]):
+    """Upsert chapter metadata into the local corpus"""
+    if not chapters:
+        return
+    await db.quran_chapters.bulk_write([
+        ReplaceOne({"id": chapter.id}, chapter.dict(), upsert=True)
+        for chapter in chapters
+    ], ordered=False)
+
+async def store_verses(chapter_id: int, verses: List[QuranVerse]):
+    """Upsert a chapter's verses into the local corpus"""
+    if not verses:
+        return
+    await db.quran_verses.bulk_write([
+        ReplaceOne(
+            {"chapter_id": chapter_id, "verse_number": verse.verse_number},
+            {"chapter_id": chapter_id, **verse.dict()},
+            upsert=True
+        )
+        for verse in verses
+    ], ordered=False)
+
+async def read_chapters() -> List[QuranChapter]:
+    """Chapters from the local corpus, falling back to Quran.com"""
+    try:
+        docs = await db.quran_chapters.find({}, {"_id": 0}).sort("id", 1).to_list(114)
+        if len(docs) == 114:
+            return [QuranChapter(**doc) for doc in docs]
+    except Exception as e:
+        logging.error(f"Error reading chapters from corpus: {e}")
+    
+    chapters = await fetch_quran_chapters()
+    if len(chapters) == 114:
+        try:
+            await store_chapters(chapters)
+        except Exception as e:
+            logging.error(f"Error storing chapters in corpus: {e}")
+    return chapters
+
+async def read_verses(chapter_id: int, page: int = 1, per_page: int = MAX_VERSES_PER_PAGE) -> List[QuranVerse]:
+    """One page of a chapter's verses from the local corpus, falling back to Quran.com"""
+    # Verse numbers are contiguous, so a page is a range scan on the
+    # (chapter_id, verse_number) index rather than a skip
+    first = (page - 1) * per_page + 1
+    if page < 1 or per_page < 1 or first > VERSE_COUNTS[chapter_id - 1]:
+        # Past the end of the chapter; never worth an upstream fetch
+        return []
+    last = min(first + per_page - 1, VERSE_COUNTS[chapter_id - 1])
+    try:
+        docs = await db.quran_verses.find(
+            {"chapter_id": chapter_id, "verse_number": {"$gte": first, "$lte": last}},
+            {"_id": 0, "chapter_id": 0}
+        ).sort("verse_number", 1).to_list(per_page)
+        # A short page means the corpus is incomplete for this chapter
+        if len(docs) == last - first + 1:
+            return [QuranVerse(**doc) for doc in docs]
+    except Exception as e:
+        logging.error(f"Error reading verses for chapter {chapter_id} from corpus: {e}")
+    
+    verses = await fetch_quran_verses(chapter_id)
+    if verses:
+        try:
+            await store_verses(chapter_id, verses)
+        except Exception as e:
+            logging.error(f"Error storing verses for chapter {chapter_id} in corpus: {e}")
+    return [verse for verse in verses if first <= verse.verse_number <= last]
+
+async def load_chapters() -> List[QuranChapter]:
+    """Chapters through the in-process cache"""
+    return await chapters_cache.get_or_load(("chapters", DEFAULT_TRANSLATION_ID), read_chapters)
+
+async def load_verses(chapter_id: int, page: int = 1, per_page: int = MAX_VERSES_PER_PAGE) -> List[QuranVerse]:
+    """One page of a chapter's verses through the in-process cache"""
+    if not (1 <= chapter_id <= 114):
+        raise HTTPException(status_code=400, detail="Invalid chapter ID")
+    return await verses_cache.get_or_load(
+        (chapter_id, page, per_page, DEFAULT_TRANSLATION_ID),
+        lambda: read_verses(chapter_id, page, per_page)
+    )
+
+async def load_audio_index(reciter: str, chapter_id: int) -> Dict[str, str]:
+    """A reciter's verse_key -> url index for one chapter, fetched once per (reciter, chapter)"""
+    reciter_id = normalize_reciter_id(reciter)
+    return await audio_index_cache.get_or_load(
+        (reciter_id, chapter_id),
+        lambda: fetch_audio_index(reciter_id, chapter_id)
+    )
+
+async def ingest_quran_corpus(concurrency: int = 4) -> Dict[str, int]:
+    """Page through all 114 chapters once and store them locally"""
+    chapters = await fetch_quran_chapters()
+    if len(chapters) != 114:
+        raise RuntimeError(f"Expected 114 chapters from Quran.com, got {len(chapters)}")
+    await store_chapters(chapters)
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    counts: Dict[str, int] = {}
+    
+    async def ingest_chapter(chapter: QuranChapter):
+        async with semaphore:
+            verses = await fetch_quran_verses(chapter.id)
+            if len(verses) != chapter.verses_count:
+                raise RuntimeError(
+                    f"Chapter {chapter.id}: expected {chapter.verses_count} verses, got {len(verses)}"
+                )
+            await store_verses(chapter.id, verses)
+            counts[str(chapter.id)] = len(verses)
+            logging.info(f"Ingested chapter {chapter.id} ({len(verses)} verses)")
+    
+    await asyncio.gather(*(ingest_chapter(chapter) for chapter in chapters))
+    return counts
+
+# Materialized leaderboard
+# Ranks are kept in memory as sorted (-score, user_id) lists: rank lookups are a
+# bisect. Boards are fully rebuilt at startup and every
+# LEADERBOARD_FULL_REBUILD_SECONDS; in between, each refresh only re-reads users
+# whose last_activity moved since the previous one, so XP earned on other
+# workers is picked up without scanning every user. Daily and weekly boards
+# come from the learning_daily rollups rather than raw sessions.
+LEADERBOARD_PROJECTION = {"_id": 0, "id": 1, "username": 1, "level": 1, "experience_points": 1, "is_active": 1}
+LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 60))
+LEADERBOARD_FULL_REBUILD_SECONDS = int(os.environ.get('LEADERBOARD_FULL_REBUILD_SECONDS', 3600))
+# Writes committed just before a refresh can carry a slightly earlier timestamp
+LEADERBOARD_RECONCILE_OVERLAP = timedelta(seconds=5)
+LEADERBOARD_PERIODS = ("all", "daily", "weekly")
+
+class RankedBoard:
+    """Scores ordered for top-N, rank-of-user and page-around-user queries"""
+
+    def __init__(self, period_start: Optional[datetime] = None):
+        self.period_start = period_start
+        self._scores: Dict[str, int] = {}
+        self._order: List[tuple] = []
+
+    def set_score(self, user_id: str, score: int):
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old, user_id))]
+        self._scores[user_id] = score
+        insort(self._order, (-score, user_id))
+
+    def add_score(self, user_id: str, delta: int):
+        self.set_score(user_id, self._scores.get(user_id, 0) + delta)
+
+    def load(self, scores: Dict[str, int]):
+        """Replace every score at once with a single O(n log n) sort"""
+        self._scores = scores
+        self._order = sorted((-score, user_id) for user_id, score in scores.items())
+
+    def remove(self, user_id: str):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old, user_id))]
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """1-based rank, O(log n)"""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return bisect_left(self._order, (-score, user_id)) + 1
+
+    def score(self, user_id: str) -> Optional[int]:
+        return self._scores.get(user_id)
+
+    def slice(self, start: int, stop: int) -> List[tuple]:
+        """(rank, user_id, score) for 0-based positions [start, stop)"""
+        start = max(start, 0)
+        return [
+            (position + 1, user_id, -negative_score)
+            for position, (negative_score, user_id) in enumerate(self._order[start:stop], start)
+        ]
+
+    def __len__(self):
+        return len(self._order)
+
+def period_start(period: str, now: datetime) -> Optional[datetime]:
+    """Start of the current daily/weekly period (UTC)"""
+    day = datetime(now.year, now.month, now.day)
+    if period == "daily":
+        return day
+    if period == "weekly":
+        return day - timedelta(days=day.weekday())
+    return None
+
+class Leaderboard:
+    """All-time and periodic boards plus the usernames/levels needed to render them"""
+
+    def __init__(self):
+        self.boards: Dict[str, RankedBoard] = {"all": RankedBoard()}
+        self.profiles: Dict[str, tuple] = {}
+        self.last_rebuild: Optional[datetime] = None
+        self.last_full_rebuild: Optional[datetime] = None
+
+    def board(self, period: str) -> RankedBoard:
+        """The board for a period, rolled over when the period has ended"""
+        board = self.boards.get(period)
+        start = period_start(period, datetime.utcnow())
+        if board is None or board.period_start != start:
+            board = RankedBoard(start)
+            self.boards[period] = board
+        return board
+
+    def record(self, user: Dict[str, Any], experience_gained: int = 0):
+        """Apply a user's new XP total and the XP gained to every board"""
+        self.profiles[user["id"]] = (user["username"], user.get("level", 1))
+        self.board("all").set_score(user["id"], user.get("experience_points", 0))
+        if experience_gained:
+            for period in ("daily", "weekly"):
+                self.board(period).add_score(user["id"], experience_gained)
+
+    def remove(self, user_id: str):
+        self.profiles.pop(user_id, None)
+        for board in self.boards.values():
+            board.remove(user_id)
+
+    def entries(self, board: RankedBoard, start: int, stop: int) -> List[Dict[str, Any]]:
+        entries = []
+        for rank, user_id, score in board.slice(start, stop):
+            username, level = self.profiles.get(user_id, ("", 1))
+            entries.append({"rank": rank, "username": username, "level": level, "experience_points": score})
+        return entries
+
+    async def period_boards(self, now: datetime, profiles: Dict[str, tuple]) -> Dict[str, RankedBoard]:
+        """Daily and weekly boards summed from the learning_daily rollups"""
+        boards = {}
+        for period in ("daily", "weekly"):
+            start = period_start(period, now)
+            board = RankedBoard(start)
+            pipeline = [
+                {"$match": {"date": {"$gte": day_key(start)}}},
+                {"$group": {"_id": "$user_id", "experience": {"$sum": "$experience"}}}
+            ]
+            board.load({
+                row["_id"]: row["experience"]
+                async for row in db.learning_daily.aggregate(pipeline)
+                if row["_id"] in profiles
+            })
+            boards[period] = board
+        return boards
+
+    async def rebuild(self):
+        """Rebuild every board from Mongo"""
+        now = datetime.utcnow()
+        boards = {"all": RankedBoard()}
+        profiles = {}
+        scores = {}
+        async for user in db.users.find({"is_active": True}, LEADERBOARD_PROJECTION):
+            profiles[user["id"]] = (user["username"], user.get("level", 1))
+            scores[user["id"]] = user.get("experience_points", 0)
+        boards["all"].load(scores)
+        boards.update(await self.period_boards(now, profiles))
+        
+        self.boards, self.profiles = boards, profiles
+        self.last_rebuild = self.last_full_rebuild = now
+        logging.info(f"Leaderboard rebuilt with {len(boards['all'])} users")
+
+    async def reconcile(self):
+        """Apply users changed since the last refresh and recompute the period boards"""
+        now = datetime.utcnow()
+        changed = db.users.find(
+            {"last_activity": {"$gte": self.last_rebuild - LEADERBOARD_RECONCILE_OVERLAP}},
+            LEADERBOARD_PROJECTION
+        )
+        updated = 0
+        async for user in changed:
+            if user.get("is_active", True):
+                self.profiles[user["id"]] = (user["username"], user.get("level", 1))
+                self.boards["all"].set_score(user["id"], user.get("experience_points", 0))
+            else:
+                self.remove(user["id"])
+            updated += 1
+        self.boards.update(await self.period_boards(now, self.profiles))
+        self.last_rebuild = now
+        logging.debug(f"Leaderboard reconciled {updated} changed users")
+
+    async def refresh_forever(self, interval: int):
+        """Background task reconciling with writes made by other workers"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                since_full = None if self.last_full_rebuild is None else (datetime.utcnow() - self.last_full_rebuild).total_seconds()
+                if since_full is None or since_full >= LEADERBOARD_FULL_REBUILD_SECONDS:
+                    await self.rebuild()
+                else:
+                    await self.reconcile()
+            except Exception as e:
+                logging.error(f"Error refreshing leaderboard: {e}")
+
+leaderboard = Leaderboard()
+
+# Compact progress bitmaps
+# One document per user holds a 6236-bit completion bitmap (one bit per ayah in
+# mushaf order) as 64-bit words, plus per-surah completed counters. Words and
+# counters are stored as objects keyed by index so $bit/$inc upserts work
+# without initialising the document first.
+VERSE_COUNTS = [
+    7, 286, 200, 176, 120, 165, 206, 75, 129, 109, 123, 111, 43, 52, 99, 128, 111, 110, 98, 135,
+    112, 78, 118, 64, 77, 227, 93, 88, 69, 60, 34, 30, 73, 54, 45, 83, 182, 88, 75, 85,
+    54, 53, 89, 59, 37, 35, 38, 29, 18, 45, 60, 49, 62, 55, 78, 96, 29, 22, 24, 13,
+    14, 11, 11, 18, 12, 12, 30, 52, 52, 44, 28, 28, 20, 56, 40, 31, 50, 40, 46, 42,
+    29, 19, 36, 25, 22, 17, 19, 26, 30, 20, 15, 21, 11, 8, 8, 19, 5, 8, 8, 11,
+    11, 8, 3, 9, 5, 4, 7, 3, 6, 3, 5, 4, 5, 6
+]
+TOTAL_AYAHS = sum(VERSE_COUNTS)  # 6236
+SURAH_OFFSETS = np.concatenate(([0], np.cumsum(VERSE_COUNTS)[:-1]))
+BITMAP_WORDS = (TOTAL_AYAHS + 63) // 64
+
+def ayah_bit(surah_number: int, ayah_number: int) -> int:
+    """Position of an ayah in the completion bitmap"""
+    if not (1 <= surah_number <= 114) or not (1 <= ayah_number <= VERSE_COUNTS[surah_number - 1]):
+        raise ValueError(f"Invalid ayah {surah_number}:{ayah_number}")
+    return int(SURAH_OFFSETS[surah_number - 1]) + ayah_number - 1
+
+def to_int64(word: int) -> Int64:
+    """Reinterpret an unsigned 64-bit mask as the signed value BSON stores"""
+    return Int64(word - (1 << 64) if word >= (1 << 63) else word)
+
+def bitmap_array(words: Dict[str, int]) -> np.ndarray:
+    """Unpack stored words into a 0/1 array of length TOTAL_AYAHS"""
+    packed = np.zeros(BITMAP_WORDS, dtype=np.int64)
+    for index, word in (words or {}).items():
+        packed[int(index)] = word
+    bits = np.unpackbits(packed.astype("<i8").view(np.uint8), bitorder="little")
+    return bits[:TOTAL_AYAHS]
+
+async def set_ayahs_completed(user_id: str, ayahs: List[tuple], completed: bool = True):
+    """Set or clear completion bits for (surah, ayah) pairs atomically"""
+    masks: Dict[int, int] = defaultdict(int)
+    for surah_number, ayah_number in ayahs:
+        bit = ayah_bit(surah_number, ayah_number)
+        masks[bit // 64] |= 1 << (bit % 64)
+    if not masks:
+        return
+    
+    operation = "or" if completed else "and"
+    bit_update = {
+        f"words.{index}": {operation: to_int64(mask if completed else ~mask & ((1 << 64) - 1))}
+        for index, mask in masks.items()
+    }
+    before = await db.user_progress_bitmaps.find_one_and_update(
+        {"user_id": user_id},
+        {"$bit": bit_update, "$set": {"updated_at": datetime.utcnow()}},
+        projection={"_id": 0, **{f"words.{index}": 1 for index in masks}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    
+    # Only bits that actually flipped move the per-surah counters
+    previous_words = (before or {}).get("words", {})
+    surah_deltas: Dict[str, int] = defaultdict(int)
+    for index, mask in masks.items():
+        previous = previous_words.get(str(index), 0) & ((1 << 64) - 1)
+        flipped = mask & ~previous if completed else mask & previous
+        while flipped:
+            low = flipped & -flipped
+            bit = index * 64 + low.bit_length() - 1
+            surah_number = int(np.searchsorted(SURAH_OFFSETS, bit, side="right"))
+            surah_deltas[f"surahs.{surah_number}"] += 1 if completed else -1
+            flipped ^= low
+    if surah_deltas:
+        total = sum(surah_deltas.values())
+        await db.user_progress_bitmaps.update_one(
+            {"user_id": user_id},
+            {"$inc": {**surah_deltas, "total_completed": total}}
+        )
+
+def progress_summary(doc: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-surah completion computed from the bitmap in one vectorized pass"""
+    bits = bitmap_array((doc or {}).get("words", {}))
+    completed = np.add.reduceat(bits, SURAH_OFFSETS)
+    percent = np.round(completed * 100.0 / np.array(VERSE_COUNTS), 2)
+    total_completed = int(completed.sum())
+    return {
+        "total_completed": total_completed,
+        "total_ayahs": TOTAL_AYAHS,
+        "percent": round(total_completed * 100.0 / TOTAL_AYAHS, 2),
+        "surahs": [
+            {
+                "surah_number": surah_number,
+                "completed": int(completed[surah_number - 1]),
+                "verses_count": VERSE_COUNTS[surah_number - 1],
+                "percent": float(percent[surah_number - 1])
+            }
+            for surah_number in range(1, 115)
+        ]
+    }
+
+def build_bitmap_document(user_id: str, ayahs: List[tuple]) -> Dict[str, Any]:
+    """A complete bitmap document for a user's completed ayahs"""
+    words: Dict[int, int] = defaultdict(int)
+    surahs: Dict[str, int] = defaultdict(int)
+    for surah_number, ayah_number in set(ayahs):
+        try:
+            bit = ayah_bit(surah_number, ayah_number)
+        except ValueError:
+            continue
+        words[bit // 64] |= 1 << (bit % 64)
+        surahs[str(surah_number)] += 1
+    return {
+        "user_id": user_id,
+        "words": {str(index): to_int64(word) for index, word in words.items()},
+        "surahs": dict(surahs),
+        "total_completed": sum(surahs.values()),
+        "updated_at": datetime.utcnow()
+    }
+
+async def migrate_progress_to_bitmaps(batch_size: int = 500) -> int:
+    """Rebuild every user's bitmap from the per-ayah user_progress collection"""
+    pipeline = [
+        {"$match": {"completed": True}},
+        {"$group": {"_id": "$user_id", "ayahs": {"$push": {"s": "$surah_number", "a": "$ayah_number"}}}}
+    ]
+    operations = []
+    migrated = 0
+    async for row in db.user_progress.aggregate(pipeline, allowDiskUse=True):
+        document = build_bitmap_document(row["_id"], [(ayah["s"], ayah["a"]) for ayah in row["ayahs"]])
+        operations.append(ReplaceOne({"user_id": row["_id"]}, document, upsert=True))
+        if len(operations) >= batch_size:
+            await db.user_progress_bitmaps.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            operations = []
+    if operations:
+        await db.user_progress_bitmaps.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+    return migrated
+
+# Learning analytics
+# One rollup document per (user, UTC day) holds session, minute and XP totals
+# with a per-session_type breakdown. Rollups are $inc'ed as sessions are
+# recorded, so stats and heatmaps never scan learning_sessions.
+MAX_ANALYTICS_DAYS = 366
+
+async def record_daily_rollups(user_id: str, sessions: List["LearningSession"]):
+    """Fold sessions into their users' daily rollups with one bulk upsert"""
+    totals: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for session in sessions:
+        increments = totals[day_key(session.created_at)]
+        increments["sessions"] += 1
+        increments["minutes"] += session.duration_minutes
+        increments["experience"] += session.experience_gained
+        increments[f"by_type.{session.session_type}.sessions"] += 1
+        increments[f"by_type.{session.session_type}.minutes"] += session.duration_minutes
+    if not totals:
+        return
+    now = datetime.utcnow()
+    await db.learning_daily.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "date": day},
+            {"$inc": dict(increments), "$set": {"updated_at": now}},
+            upsert=True
+        )
+        for day, increments in totals.items()
+    ], ordered=False)
+
+def longest_and_current_run(days: List[str]) -> tuple:
+    """(longest streak, streak ending on the last day) for sorted YYYY-MM-DD keys"""
+    longest = run = 0
+    previous = None
+    for day in days:
+        ordinal = datetime.strptime(day, "%Y-%m-%d").toordinal()
+        run = run + 1 if previous is not None and ordinal == previous + 1 else 1
+        longest = max(longest, run)
+        previous = ordinal
+    return longest, run
+
+async def backfill_daily_rollups(user_id: Optional[str] = None, batch_size: int = 500) -> Dict[str, int]:
+    """Rebuild rollups from learning_sessions with an aggregation, then recompute streaks"""
+    match = {"user_id": user_id} if user_id else {}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                "type": "$session_type"
+            },
+            "sessions": {"$sum": 1},
+            "minutes": {"$sum": "$duration_minutes"},
+            "experience": {"$sum": "$experience_gained"}
+        }},
+        {"$group": {
+            "_id": {"user_id": "$_id.user_id", "date": "$_id.date"},
+            "sessions": {"$sum": "$sessions"},
+            "minutes": {"$sum": "$minutes"},
+            "experience": {"$sum": "$experience"},
+            "by_type": {"$push": {"k": "$_id.type", "v": {"sessions": "$sessions", "minutes": "$minutes"}}}
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "date": "$_id.date",
+            "sessions": 1,
+            "minutes": 1,
+            "experience": 1,
+            "by_type": {"$arrayToObject": "$by_type"},
+            "updated_at": "$$NOW"
+        }},
+        {"$merge": {"into": "learning_daily", "on": ["user_id", "date"], "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+    await db.learning_sessions.aggregate(pipeline, allowDiskUse=True).to_list(None)
+    
+    # Streaks from the rollups: one ordered pass over (user_id, date)
+    updates = []
+    users = 0
+    current_user_id, days = None, []
+    
+    async def flush():
+        nonlocal users
+        if current_user_id is None:
+            return
+        longest, run = longest_and_current_run(days)
+        updates.append(UpdateOne({"id": current_user_id}, {"$set": {
+            "streak_days": run, "longest_streak": longest, "last_active_date": days[-1]
+        }}))
+        users += 1
+        if len(updates) >= batch_size:
+            await db.users.bulk_write(updates, ordered=False)
+            updates.clear()
+    
+    cursor = db.learning_daily.find(match, {"_id": 0, "user_id": 1, "date": 1}).sort([("user_id", 1), ("date", 1)])
+    async for rollup in cursor:
+        if rollup["user_id"] != current_user_id:
+            await flush()
+            current_user_id, days = rollup["user_id"], []
+        days.append(rollup["date"])
+    await flush()
+    if updates:
+        await db.users.bulk_write(updates, ordered=False)
+    principal_cache.clear()
+    return {"users": users, "rollups": await db.learning_daily.count_documents(match)}
+
+async def read_daily_rollups(user_id: str, days: int) -> List[Dict[str, Any]]:
+    """Rollups for the last `days` UTC days, oldest first"""
+    since = day_key(datetime.utcnow() - timedelta(days=days - 1))
+    return await db.learning_daily.find(
+        {"user_id": user_id, "date": {"$gte": since}},
+        {"_id": 0, "user_id": 0, "updated_at": 0}
+    ).sort("date", 1).to_list(days)
+
+# Keyset pagination and streaming
+# Cursors are opaque tokens holding the sort key of the last item returned, so
+# each page is an index seek rather than a skip. Streams write documents as the
+# Motor cursor yields them, keeping exports in constant memory.
+MAX_PAGE_SIZE = 500
+STREAM_BATCH_SIZE = 500
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).decode()
+
+def decode_cursor(token: str, *fields: str) -> Dict[str, Any]:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if not all(field in position for field in fields):
+            raise ValueError("missing cursor field")
+        return position
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def json_default(value):
+    """Encode the non-JSON types Mongo documents carry"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+# Errors after the first chunk abort the response rather than closing it
+# cleanly, so clients never mistake a truncated stream for a complete one.
+async def ndjson_stream(cursor):
+    """One JSON document per line"""
+    try:
+        async for doc in cursor:
+            yield json.dumps(doc, default=json_default) + "\n"
+    except Exception as e:
+        logging.error(f"Error streaming documents: {e}")
+        raise
+
+async def json_array_stream(cursor):
+    """Documents as a single JSON array, written incrementally"""
+    separator = "["
+    try:
+        async for doc in cursor:
+            yield separator + json.dumps(doc, default=json_default)
+            separator = ","
+    except Exception as e:
+        logging.error(f"Error streaming documents: {e}")
+        raise
+    yield "[]" if separator == "[" else "]"
+
+async def document_stream_response(chunks, media_type: str, detail: str) -> StreamingResponse:
+    """Stream `chunks`, reading the first one before the response starts so
+    a failing query is still reported as a 500"""
+    iterator = chunks.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        return StreamingResponse(iter(()), media_type=media_type)
+    except Exception:
+        raise HTTPException(status_code=500, detail=detail)
+    
+    async def body():
+        yield first
+        async for chunk in iterator:
+            yield chunk
+    
+    return StreamingResponse(body(), media_type=media_type)
+
+# Pre-encoded content responses
+# Chapters, verses and reciters are immutable, so their JSON is encoded and
+# compressed once and served from bytes with a strong ETag per encoding
+# ("<hash>", "<hash>-gzip", "<hash>-br"), since the variants differ in bytes.
+try:
+    import orjson
+
+    def encode_json(value) -> bytes:
+        return orjson.dumps(value, default=json_default)
+except ImportError:
+    def encode_json(value) -> bytes:
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=json_default).encode("utf-8")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CONTENT_MAX_AGE = int(os.environ.get('CONTENT_MAX_AGE', 3600))
+
+class EncodedContent:
+    """A JSON body with its gzip/brotli variants and their strong ETags"""
+
+    def __init__(self, value, headers: Optional[Dict[str, str]] = None):
+        self.body = encode_json(value)
+        self.gzip = gzip.compress(self.body, compresslevel=9, mtime=0)
+        self.br = brotli.compress(self.body) if brotli is not None else None
+        self.digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{self.digest}"'
+        self.headers = headers or {}
+
+    def variant(self, encodings: set) -> tuple:
+        """(body, Content-Encoding or None, ETag) for the client's accepted encodings"""
+        if self.br is not None and "br" in encodings:
+            return self.br, "br", f'"{self.digest}-br"'
+        if "gzip" in encodings:
+            return self.gzip, "gzip", f'"{self.digest}-gzip"'
+        return self.body, None, self.etag
+
+def accepted_encodings(request: Request) -> set:
+    return {
+        token.split(";")[0].strip().lower()
+        for token in request.headers.get("accept-encoding", "").split(",")
+    }
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match check, ignoring weak validators' W/ prefix"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+def content_response(request: Request, content: EncodedContent) -> Response:
+    """Serve pre-encoded content, answering 304 when the client's copy is current"""
+    body, encoding, etag = content.variant(accepted_encodings(request))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CONTENT_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+        **content.headers
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+encoded_cache = AsyncTTLCache(
+    "encoded",
+    max_entries=int(os.environ.get('ENCODED_CACHE_SIZE', 512)),
+    ttl=CACHE_DURATION
+)
+
+async def encoded_chapters() -> Optional[EncodedContent]:
+    chapters = await load_chapters()
+    return EncodedContent([chapter.dict() for chapter in chapters]) if chapters else None
+
+async def encoded_verses(chapter_id: int, page: int, per_page: int) -> Optional[EncodedContent]:
+    verses = await load_verses(chapter_id, page, per_page)
+    if not verses:
+        return None
+    headers = {"X-Page": str(page), "X-Per-Page": str(per_page)}
+    chapter = next((c for c in await load_chapters() if c.id == chapter_id), None)
+    if chapter:
+        headers["X-Total-Count"] = str(chapter.verses_count)
+    return EncodedContent([verse.dict() for verse in verses], headers)
+
+RECITERS = [
+    {"id": "7", "name": "Mishary Rashid Alafasy"},
+    {"id": "1", "name": "AbdulBaset AbdulSamad (Mujawwad)"},
+    {"id": "2", "name": "AbdulBaset AbdulSamad (Murattal)"},
+    {"id": "3", "name": "Abdur-Rahman as-Sudais"},
+    {"id": "5", "name": "Hani ar-Rifai"}
+]
+ENCODED_RECITERS = EncodedContent(RECITERS)
+
+# Offline chapter bundles
+# `manage.py build-bundles` writes one gzip artifact per (chapter, reciter)
+# holding the chapter, its verses and the verse audio URL map, named by the
+# hash of its content, plus a manifest of those hashes. Clients diff the
+# manifest against what they hold and fetch only changed bundles. Artifacts
+# are served as application/gzip rather than with Content-Encoding so byte
+# ranges stay meaningful for resumed downloads; clients inflate them with
+# DecompressionStream. Workers re-read the manifest when its mtime changes, and
+# a rebuild keeps the previous generation's artifacts so workers still holding
+# the old manifest keep serving them until they notice the new one.
+BUNDLE_DIR = Path(os.environ.get('BUNDLE_DIR', ROOT_DIR / 'data' / 'bundles'))
+BUNDLE_RECITERS = [r.strip() for r in os.environ.get('BUNDLE_RECITERS', '7').split(',') if r.strip()]
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_MAX_AGE = 365 * 86400
+BUNDLE_MANIFEST_CHECK_SECONDS = float(os.environ.get('BUNDLE_MANIFEST_CHECK_SECONDS', 5))
+
+def bundle_filename(chapter_id: int, reciter: str, content_hash: str) -> str:
+    return f"{chapter_id:03d}.{reciter}.{content_hash}.json.gz"
+
+def bundle_url(chapter_id: int, reciter: str, content_hash: str) -> str:
+    return f"/api/quran/bundle/{chapter_id}/{reciter}/{content_hash}"
+
+async def build_chapter_bundle(chapter: QuranChapter, reciter: str) -> Optional[Dict[str, Any]]:
+    """Write one chapter bundle (if its content changed) and return its manifest entry"""
+    verses, audio = await asyncio.gather(
+        read_verses(chapter.id, 1, MAX_VERSES_PER_PAGE),
+        load_audio_index(reciter, chapter.id)
+    )
+    if len(verses) != chapter.verses_count:
+        logging.error(f"Bundle for chapter {chapter.id} skipped: {len(verses)} of {chapter.verses_count} verses")
+        return None
+    body = encode_json({
+        "format": BUNDLE_FORMAT_VERSION,
+        "translation_id": DEFAULT_TRANSLATION_ID,
+        "reciter": reciter,
+        "chapter": chapter.dict(),
+        "verses": [verse.dict() for verse in verses],
+        "audio": {verse_key: client_audio_url(url) for verse_key, url in audio.items()}
+    })
+    content_hash = hashlib.sha256(body).hexdigest()[:20]
+    artifact = gzip.compress(body, compresslevel=9, mtime=0)
+    
+    def write():
+        BUNDLE_DIR.mkdir(parents=True, exist_ok=True)
+        target = BUNDLE_DIR / bundle_filename(chapter.id, reciter, content_hash)
+        if not target.exists():
+            temp = target.with_suffix(".tmp")
+            temp.write_bytes(artifact)
+            os.replace(temp, target)
+    
+    await asyncio.get_running_loop().run_in_executor(None, write)
+    return {
+        "hash": content_hash,
+        "url": bundle_url(chapter.id, reciter, content_hash),
+        "size": len(artifact),
+        "uncompressed_size": len(body),
+        "audio_complete": len(audio) == chapter.verses_count
+    }
+
+async def build_bundles(reciters: List[str], concurrency: int = 4) -> Dict[str, Any]:
+    """Build every chapter bundle for `reciters` and write the manifest last"""
+    chapters = await read_chapters()
+    if len(chapters) != 114:
+        raise RuntimeError(f"Expected 114 chapters in the corpus, got {len(chapters)}")
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def build(chapter: QuranChapter, reciter: str):
+        async with semaphore:
+            return chapter.id, reciter, await build_chapter_bundle(chapter, reciter)
+    
+    results = await asyncio.gather(*(build(chapter, reciter) for chapter in chapters for reciter in reciters))
+    bundles: Dict[str, Dict[str, Any]] = defaultdict(dict)
+    for chapter_id, reciter, entry in results:
+        if entry is not None:
+            bundles[str(chapter_id)][reciter] = entry
+    manifest = {
+        "format": BUNDLE_FORMAT_VERSION,
+        "translation_id": DEFAULT_TRANSLATION_ID,
+        "reciters": reciters,
+        "generated_at": datetime.utcnow().isoformat(),
+        "bundles": bundles
+    }
+    
+    def write():
+        BUNDLE_DIR.mkdir(parents=True, exist_ok=True)
+        _, previous = bundle_store.read_manifest(None)
+        temp = BUNDLE_DIR / "manifest.json.tmp"
+        temp.write_bytes(encode_json(manifest))
+        os.replace(temp, BUNDLE_DIR / "manifest.json")
+        # Keep this and the previous generation; older artifacts are unreachable
+        keep = {
+            bundle_filename(int(chapter_id), reciter, entry["hash"])
+            for generation in (manifest, previous or {})
+            for chapter_id, entries in generation.get("bundles", {}).items()
+            for reciter, entry in entries.items()
+        }
+        for path in BUNDLE_DIR.glob("*.json.gz"):
+            if path.name not in keep:
+                path.unlink(missing_ok=True)
+    
+    await asyncio.get_running_loop().run_in_executor(None, write)
+    await bundle_store.refresh(force=True)
+    return manifest
+
+class BundleStore:
+    """The bundle manifest and artifacts on disk, with artifacts cached in memory"""
+
+    def __init__(self, directory: Path, cache: AsyncTTLCache):
+        self.directory = directory
+        self.cache = cache
+        self.manifest: Optional[EncodedContent] = None
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.mtime: Optional[int] = None
+        self.checked_at: Optional[float] = None
+
+    def read_manifest(self, known_mtime: Optional[int]) -> tuple:
+        """(mtime, manifest) from disk; the manifest is None when missing or
+        unchanged since `known_mtime`"""
+        path = self.directory / "manifest.json"
+        try:
+            mtime = path.stat().st_mtime_ns
+            if mtime == known_mtime:
+                return mtime, None
+            return mtime, json.loads(path.read_bytes())
+        except (OSError, ValueError):
+            return None, None
+
+    async def refresh(self, force: bool = False):
+        """Re-read the manifest if its mtime changed, checking at most every
+        BUNDLE_MANIFEST_CHECK_SECONDS unless forced"""
+        now = monotonic()
+        if not force and self.checked_at is not None and now - self.checked_at < BUNDLE_MANIFEST_CHECK_SECONDS:
+            return
+        self.checked_at = now
+        mtime, manifest = await asyncio.get_running_loop().run_in_executor(None, self.read_manifest, self.mtime)
+        if mtime is not None and mtime == self.mtime:
+            return
+        self.mtime = mtime
+        self.cache.clear()
+        if manifest is None:
+            self.manifest, self.entries = None, {}
+            return
+        self.manifest = EncodedContent(manifest)
+        self.entries = manifest.get("bundles", {})
+
+    def entry(self, chapter_id: int, reciter: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(str(chapter_id), {}).get(reciter)
+
+    async def read(self, chapter_id: int, reciter: str, content_hash: str) -> Optional[bytes]:
+        path = self.directory / bundle_filename(chapter_id, reciter, content_hash)
+        
+        async def load():
+            try:
+                return await asyncio.get_running_loop().run_in_executor(None, path.read_bytes)
+            except OSError:
+                return None
+        
+        return await self.cache.get_or_load((chapter_id, reciter, content_hash), load)
+
+bundle_cache = AsyncTTLCache(
+    "bundles",
+    max_entries=int(os.environ.get('BUNDLE_CACHE_SIZE', 128)),
+    ttl=CACHE_DURATION
+)
+bundle_store = BundleStore(BUNDLE_DIR, bundle_cache)
+
+def parse_byte_range(header: str, size: int) -> Optional[tuple]:
+    """(start, end) for a single 'bytes=' range; None for absent, multi-range,
+    malformed or inverted headers (served in full, as RFC 9110 says to ignore
+    them), ValueError when unsatisfiable"""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[6:].strip().partition("-")
+    if not (start_text or end_text).isdigit() or (start_text and end_text and not end_text.isdigit()):
+        return None
+    if not start_text:
+        length = int(end_text)
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(start_text)
+    if end_text and int(end_text) < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    end = min(int(end_text), size - 1) if end_text else size - 1
+    return start, end
+
+def artifact_response(request: Request, body: bytes, etag: str, media_type: str, headers: Dict[str, str]) -> Response:
+    """Serve immutable bytes with conditional and single-range support"""
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", **headers}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    # A stale If-Range means the client's partial copy is of other bytes: send it all
+    if_range = request.headers.get("if-range")
+    range_header = request.headers.get("range") if not if_range or if_range == etag else None
+    try:
+        byte_range = parse_byte_range(range_header, len(body))
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(body)}"})
+    if byte_range is None:
+        return Response(content=body, media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+    return Response(content=body[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+# Audio caching proxy
+# With AUDIO_PROXY enabled, audio URLs under QURAN_AUDIO_BASE are rewritten to
+# <public base>/api/audio/<path>, absolute because the frontend is served from
+# another origin (AUDIO_PUBLIC_BASE_URL, else the request's base URL). The first request for a file downloads it once (concurrent
+# requests share the download) into a size-capped directory evicted in LRU
+# order; later requests are served from disk with Range support. Zero-copy
+# sends need an ASGI server implementing http.response.zerocopysend (uvicorn
+# does not), otherwise files are streamed in chunks. Workers share the
+# directory: hits touch the file's mtime to record recency, downloads add to a
+# running total, and the directory is rescanned every AUDIO_CACHE_RESCAN_SECONDS
+# to count files written by other workers so the size cap holds across them.
+AUDIO_PROXY = os.environ.get('AUDIO_PROXY', 'false').lower() == 'true'
+AUDIO_PUBLIC_BASE_URL = os.environ.get('AUDIO_PUBLIC_BASE_URL', '')
+AUDIO_CACHE_DIR = Path(os.environ.get('AUDIO_CACHE_DIR', ROOT_DIR / 'data' / 'audio_cache'))
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get('AUDIO_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+AUDIO_MAX_FILE_BYTES = int(os.environ.get('AUDIO_MAX_FILE_BYTES', 50 * 1024 ** 2))
+AUDIO_ORIGIN_TIMEOUT = float(os.environ.get('AUDIO_ORIGIN_TIMEOUT', 30))
+AUDIO_CACHE_RESCAN_SECONDS = float(os.environ.get('AUDIO_CACHE_RESCAN_SECONDS', 300))
+AUDIO_CACHE_MAX_AGE = 30 * 86400
+AUDIO_PATH_PATTERN = re.compile(r'[A-Za-z0-9_\-]+(/[A-Za-z0-9_\-][A-Za-z0-9_.\-]*)*')
+AUDIO_CHUNK_SIZE = 256 * 1024
+
+def client_audio_url(url: Optional[str], base_url: Optional[str] = None) -> Optional[str]:
+    """The URL clients should use for an origin audio URL; origin URLs are kept
+    when no public base URL is known"""
+    prefix = f"{QURAN_AUDIO_BASE.rstrip('/')}/"
+    base = AUDIO_PUBLIC_BASE_URL or base_url
+    if AUDIO_PROXY and base and url and url.startswith(prefix):
+        return f"{base.rstrip('/')}/api/audio/{url[len(prefix):]}"
+    return url
+
+class AudioOriginError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+class AudioDiskCache:
+    """Size-capped LRU directory of audio files fetched from the audio origin"""
+
+    def __init__(self, directory: Path, max_bytes: int, origin: str):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.origin = origin
+        self.client: Optional[httpx.AsyncClient] = None
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.total_bytes = 0
+        self.scanned = False
+        self.last_scan = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.origin_errors = 0
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.origin,
+                timeout=httpx.Timeout(AUDIO_ORIGIN_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=10),
+                follow_redirects=True
+            )
+        if not self.scanned or time() - self.last_scan >= AUDIO_CACHE_RESCAN_SECONDS:
+            await self.rescan()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def scan(self) -> List[tuple]:
+        """(name, size) of the files on disk, least recently used first"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        found = []
+        for path in self.directory.iterdir():
+            try:
+                stat = path.stat()
+                if path.suffix == ".tmp":
+                    # Leftovers from a crashed download; recent ones may belong to a live worker
+                    if time() - stat.st_mtime > 3600:
+                        path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                # Evicted by another worker while listing
+                continue
+            found.append((stat.st_mtime, path.name, stat.st_size))
+        return [(name, size) for _, name, size in sorted(found)]
+
+    async def rescan(self):
+        """Re-read the directory, counting files written by every worker"""
+        found = await asyncio.get_running_loop().run_in_executor(None, self.scan)
+        self._files = OrderedDict(found)
+        self.total_bytes = sum(self._files.values())
+        self.scanned = True
+        self.last_scan = time()
+
+    @staticmethod
+    def touch(local: Path) -> Optional[int]:
+        """Mark a file as recently used; returns its size, or None if it is gone"""
+        try:
+            os.utime(local)
+            return local.stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def filename(self, path: str) -> str:
+        suffix = Path(path).suffix if len(Path(path).suffix) <= 8 else ""
+        return hashlib.sha256(path.encode()).hexdigest()[:40] + suffix
+
+    async def get(self, path: str) -> Path:
+        """Local copy of an origin file, downloading it once if needed"""
+        name = self.filename(path)
+        local = self.directory / name
+        task = self._inflight.get(name)
+        if task is None:
+            # The file may have been downloaded (or evicted) by another worker
+            size = await asyncio.get_running_loop().run_in_executor(None, self.touch, local)
+            if size is not None:
+                self.hits += 1
+                self.total_bytes += size - self._files.pop(name, 0)
+                self._files[name] = size
+                return local
+            task = self._inflight.get(name)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.discard(path)
+            self.misses += 1
+            task = asyncio.ensure_future(self._download(path, name))
+            self._inflight[name] = task
+            task.add_done_callback(lambda done, name=name: self._inflight.pop(name, None))
+        # A disconnecting client must not cancel the download for the others
+        return await asyncio.shield(task)
+
+    async def _download(self, path: str, name: str) -> Path:
+        # Also picks up files written by other workers once the rescan interval passes
+        await self.start()
+        loop = asyncio.get_running_loop()
+        target = self.directory / name
+        temp = self.directory / f"{name}.{uuid.uuid4().hex[:8]}.tmp"
+        size = 0
+        try:
+            async with self.client.stream("GET", f"/{path}") as response:
+                if response.status_code == 404:
+                    raise AudioOriginError(404, "Audio file not found")
+                if response.status_code != 200:
+                    self.origin_errors += 1
+                    raise AudioOriginError(502, f"Audio origin returned {response.status_code}")
+                handle = await loop.run_in_executor(None, open, temp, "wb")
+                try:
+                    async for chunk in response.aiter_bytes(AUDIO_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > AUDIO_MAX_FILE_BYTES:
+                            raise AudioOriginError(502, "Audio file exceeds the size limit")
+                        await loop.run_in_executor(None, handle.write, chunk)
+                finally:
+                    await loop.run_in_executor(None, handle.close)
+            await loop.run_in_executor(None, os.replace, temp, target)
+        except httpx.HTTPError as e:
+            self.origin_errors += 1
+            raise AudioOriginError(502, f"Audio origin unavailable: {type(e).__name__}")
+        finally:
+            temp.unlink(missing_ok=True)
+        
+        self.total_bytes += size - self._files.pop(name, 0)
+        self._files[name] = size
+        victims = self.evict(keep=name)
+        if victims:
+            await loop.run_in_executor(None, lambda: [victim.unlink(missing_ok=True) for victim in victims])
+        return target
+
+    def evict(self, keep: str) -> List[Path]:
+        """Drop least recently used files from the index until it fits the budget;
+        returns the paths to delete"""
+        victims = []
+        for name in list(self._files):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            self.total_bytes -= self._files.pop(name)
+            self.evictions += 1
+            victims.append(self.directory / name)
+        return victims
+
+    def discard(self, path: str):
+        """Forget a file that disappeared from disk"""
+        size = self._files.pop(self.filename(path), None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": AUDIO_PROXY,
+            "files": len(self._files),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "origin_errors": self.origin_errors,
+            "in_flight": len(self._inflight),
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+audio_cache = AudioDiskCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, QURAN_AUDIO_BASE)
+
+class FileRangeResponse(Response):
+    """Response for a byte range of a file; sent zero-copy only by ASGI servers
+    implementing http.response.zerocopysend (or pathsend for whole files),
+    streamed in chunks by all others"""
+
+    media_type = None
+
+    def __init__(self, path: Path, start: int, end: int, status_code: int, headers: Dict[str, str], head: bool = False):
+        self.path = path
+        self.start = start
+        self.length = end - start + 1
+        self.status_code = status_code
+        self.background = None
+        self.head = head
+        self.init_headers({**headers, "Content-Length": str(self.length)})
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        # Open before the headers go out, so a vanished file can still become an error response
+        handle = await loop.run_in_executor(None, open, self.path, "rb")
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if self.head or self.length <= 0:
+                await send({"type": "http.response.body", "body": b""})
+                return
+            
+            extensions = scope.get("extensions") or {}
+            if "http.response.zerocopysend" in extensions:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": handle,
+                    "offset": self.start,
+                    "count": self.length
+                })
+                return
+            if "http.response.pathsend" in extensions and self.start == 0 and self.status_code == 200:
+                await send({"type": "http.response.pathsend", "path": str(self.path)})
+                return
+            await loop.run_in_executor(None, handle.seek, self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await loop.run_in_executor(None, handle.read, min(AUDIO_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await loop.run_in_executor(None, handle.close)
+
+def audio_file_response(request: Request, path: str, local: Path):
+    """Conditional, ranged response for a cached audio file"""
+    stat = local.stat()
+    etag = f'"{local.stem[:16]}-{stat.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"public, max-age={AUDIO_CACHE_MAX_AGE}",
+        "Content-Type": mimetypes.guess_type(path)[0] or "application/octet-stream"
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Type"})
+    
+    if_range = request.headers.get("if-range")
+    range_header = request.headers.get("range") if not if_range or if_range == etag else None
+    try:
+        byte_range = parse_byte_range(range_header, stat.st_size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{stat.st_size}", "Accept-Ranges": "bytes"})
+    head = request.method == "HEAD"
+    if byte_range is None:
+        return FileRangeResponse(local, 0, stat.st_size - 1, 200, headers, head)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    return FileRangeResponse(local, start, end, 206, headers, head)
+
+# Full-text verse search
+# An inverted index over translation, transliteration and simple Arabic text,
+# ranked with BM25. Arabic is normalized (diacritics, tatweel and letter
+# variants folded) so unvowelled queries match; the last query term can be
+# treated as a prefix for autocomplete. Workers reload the index file when its
+# mtime changes, so `manage.py ingest-corpus` / `build-search-index` take
+# effect without a restart.
+SEARCH_INDEX_PATH = Path(os.environ.get('SEARCH_INDEX_PATH', ROOT_DIR / 'data' / 'search_index.json.gz'))
+SEARCH_INDEX_VERSION = 1
+SEARCH_INDEX_CHECK_SECONDS = float(os.environ.get('SEARCH_INDEX_CHECK_SECONDS', 60))
+ARABIC_DIACRITICS = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+ARABIC_FOLDS = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ة": "ه", "ؤ": "و", "ئ": "ي"})
+HTML_TAGS = re.compile(r'<sup[^>]*>.*?</sup>|<[^>]+>')
+TOKEN_PATTERN = re.compile(r'\w+')
+MAX_PREFIX_EXPANSIONS = 50
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip markup, Latin accents and Arabic diacritics"""
+    text = HTML_TAGS.sub(" ", text or "")
+    text = ARABIC_DIACRITICS.sub("", text).translate(ARABIC_FOLDS)
+    decomposed = unicodedata.normalize("NFKD", text)
+    # Drop combining marks (e.g. the macrons in transliteration) outside Arabic
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(normalize_text(text))
+
+class QuranSearchIndex:
+    """BM25 inverted index over verse documents"""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, docs: List[Dict[str, Any]], postings: Dict[str, Dict[int, int]], lengths: List[int]):
+        self.docs = docs
+        self.postings = postings
+        self.lengths = lengths
+        self.average_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        self.terms = sorted(postings)
+        # Per-document length normalisation is query independent, so precompute it
+        self.norms = [
+            self.K1 * (1 - self.B + self.B * length / self.average_length) for length in lengths
+        ] if self.average_length else []
+
+    @classmethod
+    def build(cls, verses: List[Dict[str, Any]]) -> "QuranSearchIndex":
+        docs, lengths = [], []
+        postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        for doc_id, verse in enumerate(verses):
+            docs.append({
+                "verse_key": verse["verse_key"],
+                "chapter_id": verse["chapter_id"],
+                "verse_number": verse["verse_number"],
+                "text_simple": verse.get("text_simple", ""),
+                "translation": HTML_TAGS.sub("", verse.get("translation", "")),
+                "transliteration": verse.get("transliteration", "")
+            })
+            tokens = tokenize(" ".join((
+                verse.get("translation", ""), verse.get("transliteration", ""), verse.get("text_simple", "")
+            )))
+            lengths.append(len(tokens))
+            for token in tokens:
+                postings[token][doc_id] = postings[token].get(doc_id, 0) + 1
+        return cls(docs, dict(postings), lengths)
+
+    def expand_prefix(self, prefix: str) -> List[str]:
+        start = bisect_left(self.terms, prefix)
+        matches = []
+        for term in self.terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        return matches
+
+    def search(self, query: str, limit: int = 20, prefix: bool = False) -> tuple:
+        """Return (total_matches, [(doc, score), ...]) best first"""
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+        term_groups = [[token] for token in tokens[:-1]]
+        last = tokens[-1]
+        term_groups.append(self.expand_prefix(last) if prefix else [last])
+        
+        total_docs = len(self.docs)
+        scores: Dict[int, float] = defaultdict(float)
+        for group in term_groups:
+            for term in group:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                weight = idf * (self.K1 + 1)
+                norms = self.norms
+                for doc_id, frequency in postings.items():
+                    scores[doc_id] += weight * frequency / (frequency + norms[doc_id])
+        ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return len(scores), [(self.docs[doc_id], score) for doc_id, score in ranked]
+
+    def save(self, path: Path):
+        """Persist as gzipped JSON for fast startup loading"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "version": SEARCH_INDEX_VERSION,
+            "docs": self.docs,
+            "lengths": self.lengths,
+            "postings": {term: list(postings.items()) for term, postings in self.postings.items()}
+        }
+        # Unique per process: workers building at startup must not share a temp file
+        tmp_path = path.with_suffix(f".{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with gzip.open(tmp_path, "wb") as handle:
+                handle.write(encode_json(payload))
+            tmp_path.replace(path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["QuranSearchIndex"]:
+        if not path.exists():
+            return None
+        with gzip.open(path, "rb") as handle:
+            payload = json.loads(handle.read())
+        if payload.get("version") != SEARCH_INDEX_VERSION:
+            return None
+        postings = {term: dict(entries) for term, entries in payload["postings"].items()}
+        return cls(payload["docs"], postings, payload["lengths"])
 
-async def fetch_quran_chapters():
-    """Fetch all Quran chapters from Quran.com API with caching"""
-    global cached_chapters, cache_timestamp
-    
-    # Check cache
-    current_time = datetime.utcnow().timestamp()
-    if cached_chapters and cache_timestamp and (current_time - cache_timestamp) < CACHE_DURATION:
-        return cached_chapters
-    
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get("https://api.quran.com/api/v4/chapters")
-            if response.status_code == 200:
-                chapters_data = response.json()["chapters"]
-                # Add difficulty levels based on chapter length and complexity
-                chapters = []
-                for chapter in chapters_data:
-                    if chapter["verses_count"] <= 10:
-                        difficulty = DifficultyLevel.BEGINNER
-                    elif chapter["verses_count"] <= 50:
-                        difficulty = DifficultyLevel.INTERMEDIATE
-                    else:
-                        difficulty = DifficultyLevel.ADVANCED
-                        
-                    chapters.append(QuranChapter(
-                        id=chapter["id"],
-                        name_simple=chapter["name_simple"],
-                        name_arabic=chapter["name_arabic"],
-                        verses_count=chapter["verses_count"],
-                        difficulty_level=difficulty,
-                        revelation_place=chapter["revelation_place"]
-                    ))
-                
-                # Update cache
-                cached_chapters = chapters
-                cache_timestamp = current_time
-                return chapters
-    except Exception as e:
-        logging.error(f"Error fetching chapters: {e}")
-        # Return cached data if available
-        if cached_chapters:
-            return cached_chapters
-    
-    return []
+search_index: Optional[QuranSearchIndex] = None
+search_index_mtime: Optional[int] = None
 
-async def fetch_quran_verses(chapter_id: int, per_page: int = 50):
-    """Fetch verses for a specific chapter with error handling"""
-    if not (1 <= chapter_id <= 114):
-        raise HTTPException(status_code=400, detail="Invalid chapter ID")
-    
+def search_index_file_mtime() -> Optional[int]:
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            # Fetch verses with translations and transliterations
-            verses_response = await client.get(
-                f"https://api.quran.com/api/v4/verses/by_chapter/{chapter_id}",
-                params={
-                    "translations": "131", 
-                    "words": "true", 
-                    "fields": "text_uthmani,text_simple",
-                    "per_page": per_page
-                }
-            )
-            
-            if verses_response.status_code == 200:
-                verses_data = verses_response.json()["verses"]
-                verses = []
-                
-                for verse in verses_data:
-                    # Get transliteration from words
-                    transliteration = " ".join([
-                        word.get("transliteration", {}).get("text", "") or ""
-                        for word in verse.get("words", [])
-                        if word.get("transliteration", {}).get("text")
-                    ])
-                    
-                    # Get translation (using first available translation)
-                    translation = ""
-                    if verse.get("translations"):
-                        translation = verse["translations"][0].get("text", "")
-                    
-                    verses.append(QuranVerse(
-                        verse_number=verse["verse_number"],
-                        verse_key=verse["verse_key"],
-                        text_uthmani=verse.get("text_uthmani", ""),
-                        text_simple=verse.get("text_simple", ""),
-                        translation=translation,
-                        transliteration=transliteration
-                    ))
-                
-                return verses
-    except Exception as e:
-        logging.error(f"Error fetching verses for chapter {chapter_id}: {e}")
-    
-    return []
+        return SEARCH_INDEX_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
 
-async def fetch_audio_url(chapter_id: int, verse_number: int, reciter: str = "1"):
-    """Fetch audio URL for a specific verse with better error handling"""
-    if not (1 <= chapter_id <= 114):
+async def build_search_index() -> Optional[QuranSearchIndex]:
+    """Build the index from the local corpus (which must be fully ingested)"""
+    verses = await db.quran_verses.find(
+        {}, {"_id": 0, "chapter_id": 1, "verse_number": 1, "verse_key": 1,
+             "text_simple": 1, "translation": 1, "transliteration": 1}
+    ).sort([("chapter_id", 1), ("verse_number", 1)]).to_list(None)
+    if len(verses) < TOTAL_AYAHS:
+        logging.warning(f"Search index not built: corpus has {len(verses)} of {TOTAL_AYAHS} verses")
         return None
+    return await asyncio.get_running_loop().run_in_executor(None, QuranSearchIndex.build, verses)
+
+async def init_search_index():
+    """Load the persisted index, or build and persist one from the corpus when
+    it is missing, outdated or unreadable"""
+    global search_index, search_index_mtime
+    loop = asyncio.get_running_loop()
+    index = None
+    try:
+        search_index_mtime = await loop.run_in_executor(None, search_index_file_mtime)
+        index = await loop.run_in_executor(None, QuranSearchIndex.load, SEARCH_INDEX_PATH)
+    except Exception as e:
+        logging.warning(f"Search index at {SEARCH_INDEX_PATH} is unreadable, rebuilding: {e}")
+    try:
+        if index is None:
+            index = await build_search_index()
+            if index is not None:
+                await loop.run_in_executor(None, index.save, SEARCH_INDEX_PATH)
+                search_index_mtime = await loop.run_in_executor(None, search_index_file_mtime)
+        if index is not None:
+            search_index = index
+            logging.info(f"Search index ready with {len(index.docs)} verses")
+    except Exception as e:
+        logging.error(f"Error initialising search index: {e}")
+
+async def watch_search_index_forever(interval: float):
+    """Background task reloading the index when another process rewrites the file"""
+    global search_index, search_index_mtime
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = await loop.run_in_executor(None, search_index_file_mtime)
+            if mtime is None or mtime == search_index_mtime:
+                continue
+            index = await loop.run_in_executor(None, QuranSearchIndex.load, SEARCH_INDEX_PATH)
+            search_index_mtime = mtime
+            if index is not None:
+                search_index = index
+                logging.info(f"Search index reloaded with {len(index.docs)} verses")
+        except Exception as e:
+            logging.error(f"Error reloading search index: {e}")
+
+# Startup warm-up
+POPULAR_SURAHS = [int(n) for n in os.environ.get('WARMUP_SURAHS', '1,2,18,36,55,56,67,112,113,114').split(",") if n]
+WARMUP_RECITERS = [r for r in os.environ.get('WARMUP_RECITERS', '7').split(",") if r]
+WARMUP_BUDGET_SECONDS = float(os.environ.get('WARMUP_BUDGET_SECONDS', 20))
+INDEX_RETRY_SECONDS = float(os.environ.get('INDEX_RETRY_SECONDS', 10))
+
+async def warm_up(budget: float) -> Dict[str, Any]:
+    """Preload chapters, popular surahs and their audio indexes concurrently.
+    Loads still running when the budget expires finish in the background."""
+    started = monotonic()
+    # One bulk read from the shared tier covers whatever other workers already fetched
+    prefetched = await audio_index_cache.prefetch([
+        (normalize_reciter_id(reciter), chapter_id)
+        for chapter_id in POPULAR_SURAHS
+        for reciter in WARMUP_RECITERS
+    ])
+    loads = [encoded_cache.get_or_load(("chapters",), encoded_chapters)]
+    for chapter_id in POPULAR_SURAHS:
+        loads.append(encoded_cache.get_or_load(
+            ("verses", chapter_id, 1, MAX_VERSES_PER_PAGE),
+            lambda chapter_id=chapter_id: encoded_verses(chapter_id, 1, MAX_VERSES_PER_PAGE)
+        ))
+        for reciter in WARMUP_RECITERS:
+            loads.append(load_audio_index(reciter, chapter_id))
+    tasks = [asyncio.ensure_future(load) for load in loads]
+    done, pending = await asyncio.wait(tasks, timeout=budget)
+    failed = sum(1 for task in done if task.exception() is not None or not task.result())
+    for task in pending:
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return {
+        "loaded": len(done) - failed,
+        "failed": failed,
+        "pending": len(pending),
+        "prefetched": prefetched,
+        "seconds": round(monotonic() - started, 3)
+    }
+
+async def prepare_worker():
+    """Create indexes (retrying until they exist), build derived state and warm caches"""
+    while not await create_indexes():
+        await asyncio.sleep(INDEX_RETRY_SECONDS)
+    readiness["indexes"] = True
+    readiness["last_error"] = None
+    
+    async def rebuild_leaderboard():
+        try:
+            await leaderboard.rebuild()
+        except Exception as e:
+            logging.error(f"Error building leaderboard: {e}")
     
+    results = await asyncio.gather(rebuild_leaderboard(), init_search_index(), warm_up(WARMUP_BUDGET_SECONDS))
+    warmup = results[-1]
+    readiness["warmup"] = True
+    readiness["warmup_seconds"] = warmup["seconds"]
+    logging.info(f"Warm-up finished: {warmup}")
+
+# Request metrics middleware and scrape-time gauges
+class MetricsMiddleware:
+    """Per-route latency histograms and status counts, labelled by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = monotonic()
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope; fall back to a
+            # fixed label so unmatched paths can't explode cardinality
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_duration.observe(monotonic() - started, scope["method"], route)
+            http_requests_total.inc(scope["method"], route, str(status_code))
+
+CACHES = (chapters_cache, verses_cache, audio_index_cache, principal_cache, encoded_cache, bundle_cache)
+
+metrics.gauge_collector(
+    "cache_hit_ratio", "In-process cache hit ratio (fresh and stale hits)", ("cache",),
+    lambda: [((cache.name,), cache.stats()["hit_ratio"]) for cache in CACHES]
+)
+metrics.gauge_collector(
+    "cache_entries", "In-process cache entries", ("cache",),
+    lambda: [((cache.name,), len(cache._entries)) for cache in CACHES]
+)
+metrics.gauge_collector(
+    "cache_events", "In-process cache lookups and evictions since start", ("cache", "event"),
+    lambda: [
+        ((cache.name, event), getattr(cache, event))
+        for cache in CACHES
+        for event in ("hits", "stale_hits", "misses", "coalesced", "evictions", "load_errors", "fallback_hits")
+    ]
+)
+metrics.gauge_collector(
+    "shared_cache_events", "Shared content cache hits, misses, writes and errors since start", ("event",),
+    lambda: [((event,), getattr(shared_cache, event)) for event in ("hits", "misses", "writes", "errors")]
+    if shared_cache else []
+)
+metrics.gauge_collector(
+    "audio_cache", "Audio proxy disk cache size and events since start", ("stat",),
+    lambda: [
+        ((stat,), value) for stat, value in audio_cache.stats().items()
+        if stat in ("files", "bytes", "hits", "misses", "coalesced", "evictions", "origin_errors")
+    ]
+)
+metrics.gauge_collector(
+    "upstream_connections", "Quran.com client pool connections", ("state",),
+    lambda: [
+        (("active",), quran_api.stats()["active_connections"]),
+        (("idle",), quran_api.stats()["idle_connections"]),
+        (("in_flight",), quran_api.in_flight)
+    ]
+)
+metrics.gauge_collector(
+    "upstream_circuit_state", "Quran.com circuit breaker state (0 closed, 1 half-open, 2 open)", ("endpoint",),
+    lambda: [
+        ((endpoint,), CircuitBreaker.STATE_VALUES[breaker.state])
+        for endpoint, breaker in quran_api.breakers.items()
+    ]
+)
+metrics.gauge_collector(
+    "upstream_resilience_events", "Quran.com retries, hedges and short-circuited calls since start", ("event",),
+    lambda: [
+        (("retries",), quran_api.retries_total),
+        (("hedges",), quran_api.hedges_total),
+        (("hedge_wins",), quran_api.hedge_wins),
+        (("retry_budget_exhausted",), quran_api.retry_budget.exhausted),
+        (("short_circuited",), sum(breaker.short_circuited for breaker in quran_api.breakers.values()))
+    ]
+)
+metrics.gauge_collector(
+    "cpu_pool_queue_depth", "Calls waiting for a CPU worker", ("pool",),
+    lambda: [((pool.name,), pool.waiting) for pool in (auth_pool, stripe_pool)]
+)
+metrics.gauge_collector(
+    "rate_limited_requests", "Requests rejected by the rate limiter since start", (),
+    lambda: [((), rate_limiter.limited_total)]
+)
+metrics.gauge_collector(
+    "leaderboard_users", "Users on the all-time leaderboard", (),
+    lambda: [((), len(leaderboard.boards["all"]))]
+)
+
+# Deep health is computed off the request path: a background task pings
+# Mongo and snapshots upstream breakers and caches every HEALTH_CHECK_INTERVAL
+# seconds, and /api/health serves the pre-encoded result.
+HEALTH_CHECK_INTERVAL = float(os.environ.get('HEALTH_CHECK_INTERVAL', 10))
+HEALTH_PING_TIMEOUT = float(os.environ.get('HEALTH_PING_TIMEOUT', 2))
+
+health_snapshot: Dict[str, Any] = {"status_code": 503, "body": encode_json({"status": "starting"}), "checked_at": 0.0}
+
+async def check_health() -> Dict[str, Any]:
+    """Ping Mongo and summarise upstream breakers and cache state"""
+    started = monotonic()
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            # Convert reciter string to ID if needed
-            reciter_id = reciter
-            if reciter.startswith("ar."):
-                # Map old string IDs to numeric IDs
-                reciter_map = {
-                    "ar.alafasy": "7",  # Mishary Rashid Alafasy
-                    "ar.husary": "1",   # AbdulBaset AbdulSamad (Mujawwad)
-                    "ar.minshawi": "2", # AbdulBaset AbdulSamad (Murattal)
-                    "ar.muhammed": "3", # Abdur-Rahman as-Sudais
-                    "ar.walk": "5"      # Hani ar-Rifai
-                }
-                reciter_id = reciter_map.get(reciter, "1")
-            
-            # Try the verse-specific audio endpoint
-            response = await client.get(
-                f"https://api.quran.com/api/v4/recitations/{reciter_id}/by_chapter/{chapter_id}"
-            )
-            if response.status_code == 200:
-                data = response.json()
-                if "audio_files" in data and len(data["audio_files"]) > 0:
-                    # Find the specific verse audio
-                    for audio_file in data["audio_files"]:
-                        if audio_file.get("verse_key") == f"{chapter_id}:{verse_number}":
-                            return f"https://verses.quran.com/{audio_file.get('url')}"
-                    # If specific verse not found, return the first audio file
-                    return f"https://verses.quran.com/{data['audio_files'][0].get('url')}"
+        await asyncio.wait_for(client.admin.command("ping"), HEALTH_PING_TIMEOUT)
+        mongo = {"ok": True, "latency_ms": round((monotonic() - started) * 1000, 2)}
     except Exception as e:
-        logging.error(f"Error fetching audio for chapter {chapter_id}, verse {verse_number}: {e}")
+        logging.error(f"Health check failed: {e}")
+        mongo = {"ok": False, "error": str(e) or type(e).__name__}
     
-    return None
+    breakers = quran_api.breaker_states()
+    caches = {}
+    for cache in CACHES:
+        stats = cache.stats()
+        caches[cache.name] = {key: stats[key] for key in ("size", "hit_ratio", "fallback_hits", "load_errors")}
+    if not mongo["ok"]:
+        status_text = "unhealthy"
+    elif any(b["state"] != CircuitBreaker.CLOSED for b in breakers.values()):
+        # Cached content keeps the app serving while Quran.com is down
+        status_text = "degraded"
+    else:
+        status_text = "healthy"
+    return {
+        "status": status_text,
+        "timestamp": datetime.utcnow().isoformat(),
+        "version": "1.0.0",
+        "mongo": mongo,
+        "upstream": breakers,
+        "caches": caches,
+        "ready": readiness["indexes"] and readiness["warmup"]
+    }
+
+async def refresh_health():
+    body = await check_health()
+    health_snapshot.update(
+        status_code=503 if body["status"] == "unhealthy" else 200,
+        body=encode_json(body),
+        checked_at=monotonic()
+    )
+
+async def monitor_health_forever(interval: float):
+    """Recompute the deep health snapshot on a fixed interval"""
+    while True:
+        try:
+            await refresh_health()
+        except Exception as e:
+            logging.error(f"Error computing health: {e}")
+        await asyncio.sleep(interval)
 
 # Routes with enhanced error handling
 @api_router.post("/auth/register")
@@ -380,10 +3184,11 @@ async def register(user_data: UserCreate):
         user = User(
             email=user_data.email,
             username=sanitized_username,
-            password_hash=hash_password(user_data.password)
+            password_hash=await auth_pool.run(hash_password, user_data.password)
         )
         
         await db.users.insert_one(user.dict())
+        leaderboard.record(user.dict())
         
         # Create access token
         access_token = create_access_token({"user_id": user.id})
@@ -405,7 +3210,7 @@ async def login(user_data: UserLogin):
     """Login user with validation"""
     try:
         user = await db.users.find_one({"email": user_data.email, "is_active": True})
-        if not user or not verify_password(user_data.password, user["password_hash"]):
+        if not user or not await auth_pool.run(verify_password, user_data.password, user["password_hash"]):
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         access_token = create_access_token({"user_id": user["id"]})
@@ -429,49 +3234,162 @@ async def get_profile(current_user: User = Depends(get_current_user)):
     user_dict.pop("password_hash", None)
     return user_dict
 
+@api_router.post("/user/deactivate")
+async def deactivate_account(current_user: User = Depends(get_current_user)):
+    """Deactivate the current user's account"""
+    try:
+        # last_activity moves so other workers' leaderboards drop the user on their next refresh
+        await db.users.update_one({"id": current_user.id}, {"$set": {"is_active": False, "last_activity": datetime.utcnow()}})
+        principal_cache.invalidate(current_user.id)
+        leaderboard.remove(current_user.id)
+        return {"message": "Account deactivated"}
+    except Exception as e:
+        logging.error(f"Error deactivating account: {e}")
+        raise HTTPException(status_code=500, detail="Failed to deactivate account")
+
 @api_router.get("/quran/chapters")
-async def get_chapters():
+async def get_chapters(request: Request):
     """Get all Quran chapters with difficulty levels"""
     try:
-        chapters = await fetch_quran_chapters()
-        return chapters
+        content = await encoded_cache.get_or_load(("chapters",), encoded_chapters)
+        if content is None:
+            return []
+        return content_response(request, content)
     except Exception as e:
         logging.error(f"Error getting chapters: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch chapters")
 
 @api_router.get("/quran/chapter/{chapter_id}/verses")
-async def get_verses(chapter_id: int, per_page: int = 50):
-    """Get verses for a specific chapter"""
-    if per_page > 100:
-        per_page = 100  # Limit to prevent overload
+async def get_verses(chapter_id: int, request: Request, page: int = 1, per_page: int = MAX_VERSES_PER_PAGE):
+    """Get verses for a specific chapter, one page at a time"""
+    if not (1 <= chapter_id <= 114):
+        raise HTTPException(status_code=400, detail="Invalid chapter ID")
+    page = max(page, 1)
+    per_page = min(max(per_page, 1), MAX_VERSES_PER_PAGE)
+    if (page - 1) * per_page >= VERSE_COUNTS[chapter_id - 1]:
+        return []
     
     try:
-        verses = await fetch_quran_verses(chapter_id, per_page)
-        return verses
+        content = await encoded_cache.get_or_load(
+            ("verses", chapter_id, page, per_page),
+            lambda: encoded_verses(chapter_id, page, per_page)
+        )
+        if content is None:
+            return []
+        return content_response(request, content)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error getting verses: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch verses")
 
 @api_router.get("/quran/verse/{chapter_id}/{verse_number}/audio")
-async def get_verse_audio(chapter_id: int, verse_number: int, reciter: str = "1"):
+async def get_verse_audio(chapter_id: int, verse_number: int, request: Request, reciter: str = "1"):
     """Get audio URL for a specific verse"""
     try:
-        audio_url = await fetch_audio_url(chapter_id, verse_number, reciter)
+        audio_url = await fetch_audio_url(chapter_id, verse_number, reciter, str(request.base_url))
         return {"audio_url": audio_url}
     except Exception as e:
         logging.error(f"Error getting audio: {e}")
         return {"audio_url": None}
 
+@api_router.get("/quran/chapter/{chapter_id}/audio")
+async def get_chapter_audio(chapter_id: int, request: Request, reciter: str = "1", start: int = 1, end: Optional[int] = None):
+    """Get audio URLs for a whole chapter or a verse range in one response"""
+    if not (1 <= chapter_id <= 114):
+        raise HTTPException(status_code=400, detail="Invalid chapter ID")
+    if start < 1 or (end is not None and end < start):
+        raise HTTPException(status_code=400, detail="Invalid verse range")
+    
+    try:
+        index = await load_audio_index(reciter, chapter_id)
+        audio_urls = {}
+        for verse_key, url in index.items():
+            verse_number = int(verse_key.split(":")[1])
+            if verse_number >= start and (end is None or verse_number <= end):
+                audio_urls[verse_key] = client_audio_url(url, str(request.base_url))
+        return {
+            "chapter_id": chapter_id,
+            "reciter": normalize_reciter_id(reciter),
+            "audio_urls": audio_urls
+        }
+    except Exception as e:
+        logging.error(f"Error getting chapter audio: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch audio")
+
+@api_router.api_route("/audio/{path:path}", methods=["GET", "HEAD"])
+async def proxy_audio(path: str, request: Request):
+    """Recitation audio through the local caching proxy (AUDIO_PROXY=true)"""
+    if not AUDIO_PROXY:
+        raise HTTPException(status_code=404, detail="Audio proxy is disabled")
+    if len(path) > 300 or ".." in path or not AUDIO_PATH_PATTERN.fullmatch(path):
+        raise HTTPException(status_code=400, detail="Invalid audio path")
+    try:
+        local = await audio_cache.get(path)
+        try:
+            return audio_file_response(request, path, local)
+        except FileNotFoundError:
+            # Evicted by another worker in between; fetch it again
+            audio_cache.discard(path)
+            return audio_file_response(request, path, await audio_cache.get(path))
+    except AudioOriginError as e:
+        if e.status_code != 404:
+            logging.error(f"Error proxying audio {path}: {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@api_router.get("/quran/search")
+async def search_verses(q: str, limit: int = 20, prefix: bool = False):
+    """Search verses by English phrase, transliteration or Arabic text"""
+    if search_index is None:
+        raise HTTPException(status_code=503, detail="Search index is not available yet")
+    query = q.strip()[:200]
+    if not query:
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    limit = min(max(limit, 1), 100)
+    
+    total, results = search_index.search(query, limit=limit, prefix=prefix)
+    return {
+        "query": query,
+        "total": total,
+        "results": [{**doc, "score": round(score, 4)} for doc, score in results]
+    }
+
 @api_router.get("/quran/reciters")
-async def get_reciters():
+async def get_reciters(request: Request):
     """Get available reciters"""
-    return [
-        {"id": "7", "name": "Mishary Rashid Alafasy"},
-        {"id": "1", "name": "AbdulBaset AbdulSamad (Mujawwad)"},
-        {"id": "2", "name": "AbdulBaset AbdulSamad (Murattal)"},
-        {"id": "3", "name": "Abdur-Rahman as-Sudais"},
-        {"id": "5", "name": "Hani ar-Rifai"}
-    ]
+    return content_response(request, ENCODED_RECITERS)
+
+@api_router.get("/quran/bundles/manifest")
+async def get_bundle_manifest(request: Request):
+    """Hashes and URLs of every offline chapter bundle"""
+    await bundle_store.refresh()
+    if bundle_store.manifest is None:
+        raise HTTPException(status_code=404, detail="Offline bundles have not been built")
+    response = content_response(request, bundle_store.manifest)
+    # Clients poll this to find changed bundles, so always revalidate
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@api_router.api_route("/quran/bundle/{chapter_id}/{reciter}/{content_hash}", methods=["GET", "HEAD"])
+async def get_chapter_bundle(chapter_id: int, reciter: str, content_hash: str, request: Request):
+    """One chapter's offline bundle as an immutable, content-addressed gzip artifact"""
+    await bundle_store.refresh()
+    entry = bundle_store.entry(chapter_id, reciter)
+    if entry is None or entry["hash"] != content_hash:
+        # The client may have a newer manifest from another worker
+        await bundle_store.refresh(force=True)
+        entry = bundle_store.entry(chapter_id, reciter)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Bundle not found")
+    if entry["hash"] != content_hash:
+        # Superseded: point the client at the current artifact
+        return Response(status_code=302, headers={"Location": entry["url"], "Cache-Control": "no-cache"})
+    body = await bundle_store.read(chapter_id, reciter, content_hash)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Bundle not found")
+    return artifact_response(request, body, f'"{content_hash}"', "application/gzip", {
+        "Cache-Control": f"public, max-age={BUNDLE_MAX_AGE}, immutable"
+    })
 
 @api_router.post("/learning/session")
 async def create_learning_session(
@@ -480,14 +3398,7 @@ async def create_learning_session(
 ):
     """Create a new learning session with validation"""
     try:
-        # Calculate experience points based on session type and duration
-        base_xp = 10
-        if session_data.session_type == "memorization":
-            base_xp = 20
-        elif session_data.session_type == "recitation":
-            base_xp = 15
-        
-        experience_gained = base_xp * session_data.duration_minutes
+        experience_gained = calculate_session_xp(session_data.session_type, session_data.duration_minutes)
         
         # Create full session object
         session = LearningSession(
@@ -499,22 +3410,11 @@ async def create_learning_session(
             experience_gained=experience_gained
         )
         
-        # Save session
+        # Credit XP and streak and roll up the day only once the session is saved
         await db.learning_sessions.insert_one(session.dict())
-        
-        # Update user progress
-        new_xp = current_user.experience_points + experience_gained
-        new_level = (new_xp // 100) + 1
-        
-        await db.users.update_one(
-            {"id": current_user.id},
-            {
-                "$set": {
-                    "experience_points": new_xp,
-                    "level": new_level,
-                    "last_activity": datetime.utcnow()
-                }
-            }
+        await asyncio.gather(
+            apply_experience(current_user.id, experience_gained, [day_key(session.created_at)]),
+            record_daily_rollups(current_user.id, [session])
         )
         
         return {"message": "Session created", "experience_gained": experience_gained}
@@ -523,14 +3423,195 @@ async def create_learning_session(
         logging.error(f"Error creating session: {e}")
         raise HTTPException(status_code=500, detail="Failed to create session")
 
+@api_router.post("/learning/sessions/batch")
+async def create_learning_sessions_batch(
+    batch: LearningSessionBatch,
+    current_user: User = Depends(get_current_user)
+):
+    """Ingest sessions recorded offline with one insert, one user update and one rollup write"""
+    try:
+        now = datetime.utcnow()
+        sessions = []
+        for session_data in batch.sessions:
+            sessions.append(LearningSession(
+                user_id=current_user.id,
+                surah_number=session_data.surah_number,
+                ayah_number=session_data.ayah_number,
+                session_type=session_data.session_type,
+                duration_minutes=session_data.duration_minutes,
+                experience_gained=calculate_session_xp(session_data.session_type, session_data.duration_minutes),
+                # Never trust a client clock that claims the future
+                created_at=min(session_data.recorded_at or now, now)
+            ))
+        total_experience = sum(session.experience_gained for session in sessions)
+        
+        await db.learning_sessions.insert_many([session.dict() for session in sessions])
+        await asyncio.gather(
+            apply_experience(current_user.id, total_experience, [day_key(session.created_at) for session in sessions]),
+            record_daily_rollups(current_user.id, sessions)
+        )
+        
+        return {
+            "message": "Sessions created",
+            "sessions_created": len(sessions),
+            "experience_gained": total_experience
+        }
+    
+    except Exception as e:
+        logging.error(f"Error creating session batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create sessions")
+
+@api_router.get("/learning/stats")
+async def get_learning_stats(days: int = 30, current_user: User = Depends(get_current_user)):
+    """Totals, per-type breakdown and streaks over the last `days` days, from daily rollups"""
+    days = min(max(days, 1), MAX_ANALYTICS_DAYS)
+    try:
+        rollups = await read_daily_rollups(current_user.id, days)
+    except Exception as e:
+        logging.error(f"Error getting learning stats: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch stats")
+    
+    totals = {"sessions": 0, "minutes": 0, "experience": 0}
+    by_type: Dict[str, Dict[str, int]] = defaultdict(lambda: {"sessions": 0, "minutes": 0})
+    for rollup in rollups:
+        for field in totals:
+            totals[field] += rollup.get(field, 0)
+        for session_type, counts in (rollup.get("by_type") or {}).items():
+            by_type[session_type]["sessions"] += counts.get("sessions", 0)
+            by_type[session_type]["minutes"] += counts.get("minutes", 0)
+    return {
+        "days": days,
+        **totals,
+        "active_days": len(rollups),
+        "by_type": by_type,
+        "current_streak": current_streak(current_user),
+        "longest_streak": max(current_user.longest_streak, current_user.streak_days),
+        "last_active_date": current_user.last_active_date
+    }
+
+@api_router.get("/learning/heatmap")
+async def get_learning_heatmap(days: int = 365, current_user: User = Depends(get_current_user)):
+    """Per-day sessions and minutes for active days in the last `days` days"""
+    days = min(max(days, 1), MAX_ANALYTICS_DAYS)
+    try:
+        rollups = await read_daily_rollups(current_user.id, days)
+    except Exception as e:
+        logging.error(f"Error getting learning heatmap: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch heatmap")
+    return {
+        "days": days,
+        "activity": [
+            {"date": rollup["date"], "sessions": rollup.get("sessions", 0), "minutes": rollup.get("minutes", 0)}
+            for rollup in rollups
+        ]
+    }
+
 @api_router.get("/learning/progress")
 async def get_user_progress(current_user: User = Depends(get_current_user)):
-    """Get user's learning progress"""
+    """Get user's learning progress, streamed as a JSON array"""
+    cursor = db.user_progress.find(
+        {"user_id": current_user.id}, {"_id": 0}
+    ).sort([("surah_number", 1), ("ayah_number", 1)]).batch_size(STREAM_BATCH_SIZE)
+    return await document_stream_response(json_array_stream(cursor), "application/json", "Failed to fetch progress")
+
+@api_router.get("/learning/progress/page")
+async def get_user_progress_page(
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    format: str = "json",
+    current_user: User = Depends(get_current_user)
+):
+    """Keyset-paginated progress ordered by (surah, ayah); format=ndjson streams the rest"""
+    query: Dict[str, Any] = {"user_id": current_user.id}
+    if cursor:
+        position = decode_cursor(cursor, "s", "a")
+        query["$or"] = [
+            {"surah_number": {"$gt": position["s"]}},
+            {"surah_number": position["s"], "ayah_number": {"$gt": position["a"]}}
+        ]
+    find = db.user_progress.find(query, {"_id": 0}).sort([("surah_number", 1), ("ayah_number", 1)])
+    if format == "ndjson":
+        return await document_stream_response(
+            ndjson_stream(find.batch_size(STREAM_BATCH_SIZE)), "application/x-ndjson", "Failed to fetch progress"
+        )
+    
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    try:
+        items = await find.limit(limit + 1).to_list(limit + 1)
+    except Exception as e:
+        logging.error(f"Error getting progress page: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch progress")
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor({"s": items[-1]["surah_number"], "a": items[-1]["ayah_number"]})
+    return {"items": items, "next_cursor": next_cursor}
+
+@api_router.get("/learning/sessions")
+async def get_learning_sessions(
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    format: str = "json",
+    current_user: User = Depends(get_current_user)
+):
+    """Keyset-paginated session history, newest first; format=ndjson streams the rest"""
+    query: Dict[str, Any] = {"user_id": current_user.id}
+    if cursor:
+        position = decode_cursor(cursor, "t", "i")
+        try:
+            created_at = datetime.fromisoformat(position["t"])
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": position["i"]}}
+        ]
+    find = db.learning_sessions.find(query, {"_id": 0}).sort([("created_at", -1), ("id", -1)])
+    if format == "ndjson":
+        return await document_stream_response(
+            ndjson_stream(find.batch_size(STREAM_BATCH_SIZE)), "application/x-ndjson", "Failed to fetch sessions"
+        )
+    
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    try:
+        items = await find.limit(limit + 1).to_list(limit + 1)
+    except Exception as e:
+        logging.error(f"Error getting sessions page: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch sessions")
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor({"t": items[-1]["created_at"].isoformat(), "i": items[-1]["id"]})
+    return {"items": items, "next_cursor": next_cursor}
+
+def progress_upsert(user_id: str, progress_data: UserProgressCreate):
+    """Filter and update for a single-round-trip upsert keyed by the unique (user, surah, ayah) index"""
+    progress = UserProgress(
+        user_id=user_id,
+        surah_number=progress_data.surah_number,
+        ayah_number=progress_data.ayah_number,
+        completed=progress_data.completed,
+        experience_gained=progress_data.experience_gained,
+        difficulty_level=progress_data.difficulty_level
+    )
+    fields = progress.dict()
+    progress_id = fields.pop("id")
+    return (
+        {"user_id": user_id, "surah_number": progress.surah_number, "ayah_number": progress.ayah_number},
+        {"$set": fields, "$setOnInsert": {"id": progress_id}}
+    )
+
+@api_router.get("/learning/progress/summary")
+async def get_progress_summary(current_user: User = Depends(get_current_user)):
+    """Per-surah completion from the user's progress bitmap"""
     try:
-        progress = await db.user_progress.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-        return progress
+        doc = await db.user_progress_bitmaps.find_one(
+            {"user_id": current_user.id},
+            {"_id": 0, "words": 1}
+        )
+        return progress_summary(doc)
     except Exception as e:
-        logging.error(f"Error getting progress: {e}")
+        logging.error(f"Error getting progress summary: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch progress")
 
 @api_router.post("/learning/progress")
@@ -539,31 +3620,18 @@ async def update_progress(
     current_user: User = Depends(get_current_user)
 ):
     """Update user's progress on a specific verse"""
+    if progress_data.ayah_number > VERSE_COUNTS[progress_data.surah_number - 1]:
+        raise HTTPException(status_code=400, detail="Ayah number exceeds chapter length")
+    
     try:
-        # Create full progress object
-        progress = UserProgress(
-            user_id=current_user.id,
-            surah_number=progress_data.surah_number,
-            ayah_number=progress_data.ayah_number,
-            completed=progress_data.completed,
-            experience_gained=progress_data.experience_gained,
-            difficulty_level=progress_data.difficulty_level
-        )
-        
-        # Check if progress already exists
-        existing_progress = await db.user_progress.find_one({
-            "user_id": current_user.id,
-            "surah_number": progress_data.surah_number,
-            "ayah_number": progress_data.ayah_number
-        })
-        
-        if existing_progress:
-            await db.user_progress.update_one(
-                {"id": existing_progress["id"]},
-                {"$set": progress.dict()}
+        await asyncio.gather(
+            db.user_progress.update_one(*progress_upsert(current_user.id, progress_data), upsert=True),
+            set_ayahs_completed(
+                current_user.id,
+                [(progress_data.surah_number, progress_data.ayah_number)],
+                progress_data.completed
             )
-        else:
-            await db.user_progress.insert_one(progress.dict())
+        )
         
         return {"message": "Progress updated"}
     
@@ -571,46 +3639,332 @@ async def update_progress(
         logging.error(f"Error updating progress: {e}")
         raise HTTPException(status_code=500, detail="Failed to update progress")
 
-@api_router.get("/leaderboard")
-async def get_leaderboard(limit: int = 10):
-    """Get top users by experience points"""
-    if limit > 50:
-        limit = 50  # Prevent overload
-    
-    try:
-        users = await db.users.find(
-            {"is_active": True}, 
-            {"_id": 0, "password_hash": 0, "email": 0}
-        ).sort("experience_points", -1).limit(limit).to_list(limit)
-        
-        leaderboard = []
-        for i, user in enumerate(users):
-            leaderboard.append({
-                "rank": i + 1,
-                "username": user["username"],
-                "level": user["level"],
-                "experience_points": user["experience_points"]
-            })
-        return leaderboard
+@api_router.post("/learning/progress/batch")
+async def update_progress_batch(
+    batch: UserProgressBatch,
+    current_user: User = Depends(get_current_user)
+):
+    """Apply a list or range of ayah progress updates with one bulk_write"""
+    items = list(batch.items or [])
+    if batch.range is not None:
+        ayah_range = batch.range
+        if ayah_range.end_ayah < ayah_range.start_ayah:
+            raise HTTPException(status_code=400, detail="Invalid ayah range")
+        if ayah_range.end_ayah > VERSE_COUNTS[ayah_range.surah_number - 1]:
+            raise HTTPException(status_code=400, detail="Ayah range exceeds chapter length")
+        items.extend(
+            UserProgressCreate(
+                surah_number=ayah_range.surah_number,
+                ayah_number=ayah_number,
+                completed=ayah_range.completed,
+                experience_gained=ayah_range.experience_gained,
+                difficulty_level=ayah_range.difficulty_level
+            )
+            for ayah_number in range(ayah_range.start_ayah, ayah_range.end_ayah + 1)
+        )
+    if not items:
+        raise HTTPException(status_code=400, detail="No progress items provided")
+    if len(items) > MAX_PROGRESS_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PROGRESS_BATCH} items per batch")
     
+    failed: Dict[int, str] = {
+        index: "Ayah number exceeds chapter length"
+        for index, item in enumerate(items)
+        if item.ayah_number > VERSE_COUNTS[item.surah_number - 1]
+    }
+    # bulk_write reports positions within the submitted operations
+    submitted = [index for index in range(len(items)) if index not in failed]
+    upserted: set = set()
+    try:
+        if submitted:
+            result = await db.user_progress.bulk_write(
+                [UpdateOne(*progress_upsert(current_user.id, items[index]), upsert=True) for index in submitted],
+                ordered=False
+            )
+            upserted = {submitted[position] for position in result.upserted_ids}
+    except BulkWriteError as e:
+        # Unordered writes keep going past failures; report them per item
+        for error in e.details.get("writeErrors", []):
+            failed[submitted[error["index"]]] = error.get("errmsg", "write failed")
+        upserted = {submitted[entry["index"]] for entry in e.details.get("upserted", [])}
+    except Exception as e:
+        logging.error(f"Error updating progress batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to update progress")
+    
+    try:
+        for completed in (True, False):
+            await set_ayahs_completed(current_user.id, [
+                (item.surah_number, item.ayah_number)
+                for index, item in enumerate(items)
+                if index not in failed and item.completed == completed
+            ], completed)
     except Exception as e:
-        logging.error(f"Error getting leaderboard: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch leaderboard")
+        logging.error(f"Error updating progress bitmap: {e}")
+    
+    results = []
+    for index, item in enumerate(items):
+        entry = {"surah_number": item.surah_number, "ayah_number": item.ayah_number}
+        if index in failed:
+            entry.update(status="error", error=failed[index])
+        else:
+            entry["status"] = "created" if index in upserted else "updated"
+        results.append(entry)
+    
+    return {
+        "message": "Progress updated",
+        "updated": len(items) - len(failed),
+        "failed": len(failed),
+        "results": results
+    }
+
+@api_router.get("/leaderboard")
+async def get_leaderboard(limit: int = 10, period: str = "all"):
+    """Get top users by experience points (all time, daily or weekly)"""
+    if period not in LEADERBOARD_PERIODS:
+        raise HTTPException(status_code=400, detail="Invalid leaderboard period")
+    limit = min(max(limit, 1), 50)  # Prevent overload; negative stops would slice the whole board
+    
+    return leaderboard.entries(leaderboard.board(period), 0, limit)
+
+@api_router.get("/leaderboard/me")
+async def get_my_rank(
+    period: str = "all",
+    radius: int = 5,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the current user's rank and the page of users around them"""
+    if period not in LEADERBOARD_PERIODS:
+        raise HTTPException(status_code=400, detail="Invalid leaderboard period")
+    radius = min(max(radius, 0), 25)
+    
+    board = leaderboard.board(period)
+    rank = board.rank(current_user.id)
+    if rank is None:
+        return {"rank": None, "experience_points": 0, "total": len(board), "around": []}
+    return {
+        "rank": rank,
+        "experience_points": board.score(current_user.id),
+        "total": len(board),
+        "around": leaderboard.entries(board, rank - 1 - radius, rank + radius)
+    }
+
+@api_router.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until indexes exist and warm-up has finished"""
+    ready = readiness["indexes"] and readiness["warmup"]
+    body = {"status": "ready" if ready else "starting", **readiness}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@api_router.get("/live")
+async def liveness_check():
+    """Liveness probe: the event loop is serving requests"""
+    return {"status": "alive"}
 
 @api_router.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    try:
-        # Check database connection
-        await db.users.find_one()
+    """Deep health from the last background check; 503 if Mongo is unreachable or checks have stalled"""
+    if monotonic() - health_snapshot["checked_at"] > 3 * HEALTH_CHECK_INTERVAL:
+        return Response(encode_json({"status": "stale"}), status_code=503, media_type="application/json")
+    return Response(health_snapshot["body"], status_code=health_snapshot["status_code"], media_type="application/json")
+
+@api_router.get("/cache/stats", dependencies=[Depends(require_admin)])
+async def cache_stats():
+    """In-process content cache counters and the shared tier"""
+    return {
+        **{cache.name: cache.stats() for cache in CACHES},
+        "shared": shared_cache.stats() if shared_cache else None,
+        "audio_files": audio_cache.stats()
+    }
+
+@api_router.get("/rate-limit/stats", dependencies=[Depends(require_admin)])
+async def rate_limit_stats():
+    """Rate limiter state and policies"""
+    return rate_limiter.stats()
+
+@api_router.get("/workers/stats", dependencies=[Depends(require_admin)])
+async def worker_stats():
+    """Work pool queue depth and latency, and the Stripe event queue"""
+    return {
+        auth_pool.name: auth_pool.stats(),
+        stripe_pool.name: stripe_pool.stats(),
+        "stripe_events": stripe_events.stats()
+    }
+
+@api_router.get("/upstream/stats", dependencies=[Depends(require_admin)])
+async def upstream_stats():
+    """Quran.com client pool statistics"""
+    return quran_api.stats()
+
+# Stripe webhook queue
+# Verified events are stored in stripe_events keyed by event id and
+# acknowledged at once; Stripe's retries of the same event hit the duplicate
+# key and are dropped. A worker claims pending events in batches under a
+# lease, applies their user updates with one bulk_write and marks them done.
+STRIPE_EVENT_BATCH_SIZE = int(os.environ.get('STRIPE_EVENT_BATCH_SIZE', 100))
+STRIPE_EVENT_POLL_SECONDS = float(os.environ.get('STRIPE_EVENT_POLL_SECONDS', 5))
+STRIPE_EVENT_LEASE_SECONDS = float(os.environ.get('STRIPE_EVENT_LEASE_SECONDS', 60))
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.environ.get('STRIPE_EVENT_MAX_ATTEMPTS', 10))
+STRIPE_EVENT_RETENTION_DAYS = int(os.environ.get('STRIPE_EVENT_RETENTION_DAYS', 30))
+
+class StripeEventQueue:
+    """Persistent, idempotent queue of Stripe webhook events"""
+
+    def __init__(self, batch_size: int, lease_seconds: float, max_attempts: int):
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.wakeup = asyncio.Event()
+        self.received = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.failed = 0
+        self.batches = 0
+
+    async def enqueue(self, event: Dict[str, Any]) -> bool:
+        """Store a verified event; returns False if it was already queued"""
+        self.received += 1
+        payload = event["data"]["object"]
+        try:
+            await db.stripe_events.insert_one({
+                "_id": event["id"],
+                "type": event["type"],
+                "object": {
+                    "id": payload.get("id"),
+                    "metadata": payload.get("metadata") or {}
+                },
+                "status": "pending",
+                "attempts": 0,
+                "received_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            self.duplicates += 1
+            return False
+        self.wakeup.set()
+        return True
+
+    async def claim(self) -> List[Dict[str, Any]]:
+        """Lease a batch of pending (or abandoned) events to this worker"""
+        now = datetime.utcnow()
+        candidates = await db.stripe_events.find(
+            {"$or": [
+                {"status": "pending"},
+                {"status": "processing", "lease_until": {"$lt": now}}
+            ]},
+            {"_id": 1}
+        ).sort("received_at", 1).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+        ids = [doc["_id"] for doc in candidates]
+        # Re-check status in the update so two workers can't both claim an event
+        await db.stripe_events.update_many(
+            {"_id": {"$in": ids}, "$or": [
+                {"status": "pending"},
+                {"status": "processing", "lease_until": {"$lt": now}}
+            ]},
+            {
+                "$set": {"status": "processing", "worker": self.worker_id,
+                         "lease_until": now + timedelta(seconds=self.lease_seconds)},
+                "$inc": {"attempts": 1}
+            }
+        )
+        return await db.stripe_events.find(
+            {"_id": {"$in": ids}, "status": "processing", "worker": self.worker_id}
+        ).sort("received_at", 1).to_list(len(ids))
+
+    def user_update(self, event) -> Optional[UpdateOne]:
+        """The user write for an event, or None for event types we ignore"""
+        if event["type"] != "payment_intent.succeeded":
+            return None
+        payment_intent = event["object"]
+        user_id = payment_intent["metadata"].get("user_id")
+        if not user_id:
+            return None
+        # Conditional on the intent so replays never move premium_activated_at
+        return UpdateOne(
+            {"id": user_id, "payment_intent_id": {"$ne": payment_intent["id"]}},
+            {"$set": {
+                "is_premium": True,
+                "plan_type": payment_intent["metadata"].get("plan_type"),
+                "premium_activated_at": datetime.utcnow(),
+                "payment_intent_id": payment_intent["id"]
+            }}
+        )
+
+    async def process_batch(self) -> int:
+        """Apply one claimed batch; returns the number of events handled"""
+        events = await self.claim()
+        if not events:
+            return 0
+        self.batches += 1
+        updates = []
+        user_ids = set()
+        for event in events:
+            update = self.user_update(event)
+            if update is not None:
+                updates.append(update)
+                user_ids.add(event["object"]["metadata"]["user_id"])
+        ids = [event["_id"] for event in events]
+        try:
+            if updates:
+                await db.users.bulk_write(updates, ordered=False)
+        except Exception as e:
+            logging.error(f"Error applying Stripe events {ids}: {e}")
+            await self.release(events, str(e))
+            return len(events)
+        
+        now = datetime.utcnow()
+        await db.stripe_events.update_many(
+            {"_id": {"$in": ids}, "worker": self.worker_id},
+            {"$set": {
+                "status": "done",
+                "processed_at": now,
+                "expires_at": now + timedelta(days=STRIPE_EVENT_RETENTION_DAYS)
+            }, "$unset": {"lease_until": ""}}
+        )
+        for user_id in user_ids:
+            principal_cache.invalidate(user_id)
+            logging.info(f"Applied Stripe payment event for user {user_id}", extra={"audit": True})
+        self.processed += len(events)
+        return len(events)
+
+    async def release(self, events: List[Dict[str, Any]], error: str):
+        """Return failed events to the queue, parking them after max_attempts"""
+        for event in events:
+            exhausted = event.get("attempts", 0) >= self.max_attempts
+            if exhausted:
+                self.failed += 1
+                logging.error(f"Stripe event {event['_id']} failed {event.get('attempts', 0)} times; parking it")
+            await db.stripe_events.update_one(
+                {"_id": event["_id"], "worker": self.worker_id},
+                {"$set": {"status": "failed" if exhausted else "pending", "last_error": error},
+                 "$unset": {"lease_until": ""}}
+            )
+
+    async def process_forever(self, poll_seconds: float):
+        """Drain the queue, then sleep until a webhook arrives or the poll interval passes"""
+        while True:
+            try:
+                while await self.process_batch() >= self.batch_size:
+                    pass
+            except Exception as e:
+                logging.error(f"Error processing Stripe events: {e}")
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
         return {
-            "status": "healthy",
-            "timestamp": datetime.utcnow().isoformat(),
-            "version": "1.0.0"
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "failed": self.failed,
+            "batches": self.batches,
         }
-    except Exception as e:
-        logging.error(f"Health check failed: {e}")
-        raise HTTPException(status_code=503, detail="Service unavailable")
+
+stripe_events = StripeEventQueue(STRIPE_EVENT_BATCH_SIZE, STRIPE_EVENT_LEASE_SECONDS, STRIPE_EVENT_MAX_ATTEMPTS)
 
 # Payment endpoints
 SUBSCRIPTION_PLANS = {
@@ -651,18 +4005,24 @@ async def create_payment_intent(
         if current_user.dict().get("is_premium", False):
             raise HTTPException(status_code=400, detail="User already has premium access")
         
-        intent = stripe.PaymentIntent.create(
-            amount=plan["amount"],
-            currency='usd',
-            automatic_payment_methods={'enabled': True},
-            metadata={
-                'user_id': current_user.id,
-                'plan_type': plan_type,
-                'user_email': current_user.email
-            }
-        )
+        started = monotonic()
+        outcome = "error"
+        try:
+            intent = await stripe_pool.run(lambda: stripe.PaymentIntent.create(
+                amount=plan["amount"],
+                currency='usd',
+                automatic_payment_methods={'enabled': True},
+                metadata={
+                    'user_id': current_user.id,
+                    'plan_type': plan_type,
+                    'user_email': current_user.email
+                }
+            ))
+            outcome = "ok"
+        finally:
+            stripe_request_duration.observe(monotonic() - started, "payment_intent.create", outcome)
         
-        logging.info(f"Payment intent created for user {current_user.id}: {intent.id}")
+        logging.info(f"Payment intent created for user {current_user.id}: {intent.id}", extra={"audit": True})
         
         return {
             "client_secret": intent.client_secret,
@@ -670,6 +4030,8 @@ async def create_payment_intent(
             "currency": "usd"
         }
     
+    except HTTPException:
+        raise
     except stripe.error.StripeError as e:
         logging.error(f"Stripe error: {e}")
         raise HTTPException(status_code=400, detail=f"Payment error: {str(e)}")
@@ -679,7 +4041,7 @@ async def create_payment_intent(
 
 @api_router.post("/stripe-webhook")
 async def stripe_webhook(request: Request):
-    """Handle Stripe webhooks"""
+    """Verify a Stripe webhook and queue it for processing"""
     payload = await request.body()
     sig_header = request.headers.get('stripe-signature')
     
@@ -697,28 +4059,16 @@ async def stripe_webhook(request: Request):
         logging.error(f"Invalid signature: {e}")
         raise HTTPException(status_code=400, detail="Invalid signature")
     
-    # Handle payment success
-    if event['type'] == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']
-        user_id = payment_intent['metadata'].get('user_id')
-        plan_type = payment_intent['metadata'].get('plan_type')
-        
-        if user_id:
-            # Update user to premium
-            await db.users.update_one(
-                {"id": user_id},
-                {
-                    "$set": {
-                        "is_premium": True,
-                        "plan_type": plan_type,
-                        "premium_activated_at": datetime.utcnow(),
-                        "payment_intent_id": payment_intent['id']
-                    }
-                }
-            )
-            logging.info(f"User {user_id} upgraded to premium via payment intent {payment_intent['id']}")
+    # Acknowledge at once; the queue worker applies the event
+    try:
+        # The SDK's event objects differ across versions; queue the verified JSON itself
+        queued = await stripe_events.enqueue(json.loads(payload))
+    except Exception as e:
+        # A non-2xx makes Stripe retry the delivery later
+        logging.error(f"Error queueing Stripe event {event['id']}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to queue event")
     
-    return {"status": "success"}
+    return {"status": "success" if queued else "duplicate"}
 
 @api_router.get("/subscription-status")
 async def get_subscription_status(current_user: User = Depends(get_current_user)):
@@ -733,7 +4083,13 @@ async def get_subscription_status(current_user: User = Depends(get_current_user)
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus text exposition"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Add security middleware
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])  # Configure for production
 
 app.add_middleware(
@@ -742,28 +4098,266 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Page", "X-Per-Page"],
 )
 
+# Outermost, so latency includes every other middleware
+app.add_middleware(MetricsMiddleware)
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/tmp/app.log'),
-        logging.StreamHandler()
-    ]
+# Handlers never run on the event loop: records are put on a bounded queue and
+# a QueueListener thread formats them as compact JSON and writes them to a
+# size-rotated file and stderr. Before enqueueing, records are sampled per
+# logger and rate limited per call site (WARNING and above by default), so an
+# error storm costs a counter increment rather than a disk write. Records logged
+# with extra={"audit": True}, such as payment events, are never dropped.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_FILE = os.environ.get('LOG_FILE', '/tmp/app.log')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 50 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_RATE_LIMIT_LEVEL = logging.getLevelName(os.environ.get('LOG_RATE_LIMIT_LEVEL', 'WARNING').upper())
+if not isinstance(LOG_RATE_LIMIT_LEVEL, int):
+    LOG_RATE_LIMIT_LEVEL = logging.WARNING
+
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+
+def parse_log_settings(spec: str, parse_value) -> Dict[str, Any]:
+    """Parse "logger=value,..." settings; '*' sets the default"""
+    settings = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.rpartition("=")
+        try:
+            settings[name.strip() or "*"] = parse_value(value.strip())
+        except ValueError:
+            logging.warning(f"Ignoring invalid log setting '{item}'")
+    return settings
+
+class LogThrottleFilter(logging.Filter):
+    """Samples records below WARNING per logger and rate limits records at or
+    above `rate_limit_level` per call site (logger, file, line). The next record
+    let through from a throttled call site carries the number suppressed in
+    between. Audit records bypass both."""
+
+    def __init__(self, sample_rates: Dict[str, float], rate_limits: Dict[str, tuple],
+                 rate_limit_level: int = logging.WARNING):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self.rate_limit_level = rate_limit_level
+        self.windows: Dict[tuple, list] = {}
+        self.sampled_out = 0
+        self.suppressed = 0
+
+    def setting(self, settings: Dict[str, Any], logger_name: str):
+        # Most specific dotted prefix wins
+        name = logger_name
+        while name:
+            if name in settings:
+                return settings[name]
+            name = name.rpartition(".")[0]
+        return settings.get("*")
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "audit", False):
+            return True
+        if record.levelno < logging.WARNING:
+            rate = self.setting(self.sample_rates, record.name)
+            if rate is not None and random.random() >= rate:
+                self.sampled_out += 1
+                return False
+        if record.levelno < self.rate_limit_level:
+            return True
+        limit = self.setting(self.rate_limits, record.name)
+        if limit is None:
+            return True
+        max_records, window_seconds = limit
+        key = (record.name, record.pathname, record.lineno)
+        now = monotonic()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= window_seconds:
+            suppressed = window[2] if window else 0
+            if len(self.windows) >= 10000:
+                self.windows.clear()
+            self.windows[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if window[1] >= max_records:
+            window[2] += 1
+            self.suppressed += 1
+            return False
+        window[1] += 1
+        return True
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id (runs on the calling thread)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class LogQueueHandler(QueueHandler):
+    """QueueHandler that renders only the message on the caller's thread and
+    drops (and counts) records when the queue is full instead of blocking.
+    Audit records are never dropped: on a full queue they are written
+    synchronously to `overflow_handlers`."""
+
+    def __init__(self, log_queue: queue.Queue, overflow_handlers: List[logging.Handler] = ()):
+        super().__init__(log_queue)
+        self.overflow_handlers = list(overflow_handlers)
+        self.dropped = 0
+        self.audit_overflow = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if not getattr(record, "audit", False):
+                self.dropped += 1
+                return
+            self.audit_overflow += 1
+            for handler in self.overflow_handlers:
+                handler.handle(record)
+
+class JsonLogFormatter(logging.Formatter):
+    """One compact JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return encode_json(entry).decode("utf-8")
+
+def configure_logging() -> QueueListener:
+    """Route the root logger through the queue; the listener flushes at exit"""
+    if LOG_FORMAT == "json":
+        formatter = JsonLogFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(request_id)s - %(message)s')
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if LOG_FILE:
+        try:
+            handlers.append(RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT))
+        except OSError as e:
+            logging.warning(f"Cannot open log file {LOG_FILE}: {e}")
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    queue_handler = LogQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE), overflow_handlers=handlers)
+    queue_handler.addFilter(log_throttle)
+    queue_handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+def log_pipeline_stats() -> Dict[str, int]:
+    """Records dropped by the full queue, suppressed by rate limits or sampled out"""
+    handler = next((h for h in logging.getLogger().handlers if isinstance(h, LogQueueHandler)), None)
+    return {
+        "dropped": handler.dropped if handler else 0,
+        "audit_overflow": handler.audit_overflow if handler else 0,
+        "suppressed": log_throttle.suppressed,
+        "sampled_out": log_throttle.sampled_out,
+        "queue_depth": handler.queue.qsize() if handler else 0,
+    }
+
+log_throttle = LogThrottleFilter(
+    # e.g. "httpx=0.1,root=1.0": keep that fraction of DEBUG/INFO records
+    sample_rates=parse_log_settings(os.environ.get('LOG_SAMPLE_RATES', 'httpx=0.1'), float),
+    # e.g. "*=20/10,root=50/10": at most N records per call site per window seconds
+    rate_limits=parse_log_settings(os.environ.get('LOG_RATE_LIMITS', '*=20/10'), parse_rate_limit),
+    rate_limit_level=LOG_RATE_LIMIT_LEVEL
+)
+log_listener = configure_logging()
+
+metrics.gauge_collector(
+    "log_records", "Log records dropped, rate limited or sampled out since start", ("outcome",),
+    lambda: [((outcome,), value) for outcome, value in log_pipeline_stats().items() if outcome != "queue_depth"]
 )
+
+class RequestIdMiddleware:
+    """Assigns each request an id (honouring a sane incoming X-Request-ID),
+    exposes it to log records and echoes it in the response"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming if re.fullmatch(r"[A-Za-z0-9._-]{1,64}", incoming) else uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
+
+# Outside metrics so every log line, including slow-request ones, has the id
+app.add_middleware(RequestIdMiddleware)
 logger = logging.getLogger(__name__)
 
+# Long-running tasks started at startup and cancelled on shutdown
+background_tasks: List[asyncio.Task] = []
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
-    """Initialize app on startup"""
-    await create_indexes()
+    """Initialize app on startup; readiness is reported by /api/ready"""
+    await quran_api.start()
+    if AUDIO_PROXY:
+        await audio_cache.start()
+    background_tasks.append(asyncio.create_task(prepare_worker()))
+    background_tasks.append(asyncio.create_task(leaderboard.refresh_forever(LEADERBOARD_REFRESH_SECONDS)))
+    background_tasks.append(asyncio.create_task(monitor_health_forever(HEALTH_CHECK_INTERVAL)))
+    background_tasks.append(asyncio.create_task(watch_search_index_forever(SEARCH_INDEX_CHECK_SECONDS)))
+    background_tasks.append(asyncio.create_task(stripe_events.process_forever(STRIPE_EVENT_POLL_SECONDS)))
     logger.info("Quran Learning API started successfully")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     """Clean shutdown"""
+    for task in background_tasks:
+        task.cancel()
+    await quran_api.close()
+    await audio_cache.close()
+    auth_pool.shutdown()
+    stripe_pool.shutdown()
     client.close()
     logger.info("Database connection closed")
@@ -0,0 +1,12 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py reads its configuration at import time; no MongoDB is contacted
+# until a query runs, so unit tests can import it with placeholder settings.
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "quran_learning_test")
+os.environ.setdefault("LOG_FILE", "")
+os.environ.setdefault("LOG_FORMAT", "text")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,26 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+ADMIN_ENDPOINTS = ["/api/upstream/stats", "/api/cache/stats", "/api/rate-limit/stats", "/api/workers/stats"]
+
+
+@pytest.fixture
+def client():
+    # Without entering the context manager, so startup tasks do not run
+    return TestClient(server.app)
+
+
+@pytest.mark.parametrize("path", ADMIN_ENDPOINTS)
+def test_hidden_without_admin_token(client, monkeypatch, path):
+    monkeypatch.setattr(server, "ADMIN_API_TOKEN", "")
+    assert client.get(path).status_code == 404
+
+
+@pytest.mark.parametrize("path", ADMIN_ENDPOINTS)
+def test_requires_admin_token(client, monkeypatch, path):
+    monkeypatch.setattr(server, "ADMIN_API_TOKEN", "s3cret")
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get(path, headers={"X-Admin-Token": "s3cret"}).status_code == 200
@@ -0,0 +1,27 @@
+from starlette.requests import Request
+
+from server import EncodedContent, content_response
+
+
+def make_request(**headers):
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw})
+
+
+def test_each_encoding_has_its_own_etag():
+    content = EncodedContent({"verses": list(range(100))})
+    identity = content_response(make_request(), content)
+    gzipped = content_response(make_request(accept_encoding="gzip"), content)
+    assert identity.headers["etag"] == content.etag
+    assert gzipped.headers["etag"] == f'"{content.digest}-gzip"'
+    assert gzipped.headers["content-encoding"] == "gzip"
+
+
+def test_not_modified_only_for_the_same_variant():
+    content = EncodedContent({"verses": list(range(100))})
+    etag = f'"{content.digest}-gzip"'
+    cached = content_response(make_request(accept_encoding="gzip", if_none_match=etag), content)
+    other = content_response(make_request(if_none_match=etag), content)
+    assert cached.status_code == 304
+    assert other.status_code == 200
+    assert other.headers["etag"] == content.etag
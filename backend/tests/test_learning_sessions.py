@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+class FailingCollection:
+    async def insert_one(self, document):
+        raise RuntimeError("write failed")
+
+    async def insert_many(self, documents):
+        raise RuntimeError("write failed")
+
+
+@pytest.fixture
+def no_writes(monkeypatch):
+    credited = []
+
+    async def apply_experience(*args, **kwargs):
+        credited.append(args)
+
+    async def record_daily_rollups(*args, **kwargs):
+        credited.append(args)
+
+    monkeypatch.setattr(server.db, "learning_sessions", FailingCollection(), raising=False)
+    monkeypatch.setattr(server, "apply_experience", apply_experience)
+    monkeypatch.setattr(server, "record_daily_rollups", record_daily_rollups)
+    return credited
+
+
+def make_user():
+    return server.User(username="reader", email="reader@example.com", password_hash="x")
+
+
+def test_failed_insert_credits_no_experience(no_writes):
+    session = server.LearningSessionCreate(surah_number=1, ayah_number=1, session_type="reading", duration_minutes=10)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.create_learning_session(session, make_user()))
+    assert error.value.status_code == 500
+    assert no_writes == []
+
+
+def test_failed_batch_insert_credits_no_experience(no_writes):
+    batch = server.LearningSessionBatch(sessions=[
+        {"surah_number": 1, "ayah_number": 1, "session_type": "reading", "duration_minutes": 10}
+    ])
+    with pytest.raises(HTTPException):
+        asyncio.run(server.create_learning_sessions_batch(batch, make_user()))
+    assert no_writes == []
@@ -0,0 +1,54 @@
+import logging
+import queue
+
+import server
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_record(message, **extra):
+    record = logging.LogRecord("root", logging.INFO, __file__, 1, message, (), None)
+    for name, value in extra.items():
+        setattr(record, name, value)
+    return record
+
+
+def test_audit_record_survives_a_full_queue():
+    overflow = Capture()
+    handler = server.LogQueueHandler(queue.Queue(maxsize=1), overflow_handlers=[overflow])
+    handler.handle(make_record("fills the queue"))
+    handler.handle(make_record("routine"))
+    handler.handle(make_record("Payment intent created", audit=True))
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+    assert handler.audit_overflow == 1
+    assert [record.getMessage() for record in overflow.records] == ["Payment intent created"]
+
+
+def test_audit_records_bypass_sampling_and_rate_limits():
+    throttle = server.LogThrottleFilter({"*": 0.0}, {"*": (1, 60)}, logging.INFO)
+    routine = [throttle.filter(make_record("routine")) for _ in range(3)]
+    audit = [throttle.filter(make_record("Applied Stripe payment event", audit=True)) for _ in range(3)]
+    assert routine == [False, False, False]
+    assert audit == [True, True, True]
+
+
+def test_rate_limits_apply_from_the_configured_level():
+    throttle = server.LogThrottleFilter({}, {"*": (2, 60)}, logging.WARNING)
+    info = [throttle.filter(make_record("info")) for _ in range(5)]
+    errors = []
+    for _ in range(5):
+        record = make_record("error storm")
+        record.levelno, record.levelname = logging.ERROR, "ERROR"
+        record.lineno = 2
+        errors.append(throttle.filter(record))
+    assert info == [True] * 5
+    assert errors == [True, True, False, False, False]
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+import server
+
+
+def authenticate(user_id: str):
+    token = server.create_access_token({"user_id": user_id})
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    return server.get_current_user(credentials)
+
+
+def test_deactivated_user_is_rejected_after_ttl(monkeypatch):
+    monkeypatch.setattr(server, "principal_cache", server.AsyncTTLCache("principals", max_entries=10, ttl=0.05))
+    active = {"value": True}
+
+    async def load_principal(user_id):
+        if not active["value"]:
+            return None
+        return server.User.construct(id=user_id, email="a@example.com", username="reader", password_hash="")
+
+    monkeypatch.setattr(server, "load_principal", load_principal)
+
+    async def scenario():
+        assert (await authenticate("user-1")).id == "user-1"
+        active["value"] = False
+        # Still cached within the TTL
+        assert (await authenticate("user-1")).id == "user-1"
+        await asyncio.sleep(0.06)
+        with pytest.raises(HTTPException) as error:
+            await authenticate("user-1")
+        assert error.value.status_code == 401
+        assert server.principal_cache.fallback_hits == 0
+
+    asyncio.run(scenario())
+
+
+def test_stale_content_is_served_when_reload_fails():
+    cache = server.AsyncTTLCache("content", max_entries=10, ttl=0.01, stale_ttl=0.01)
+
+    async def scenario():
+        async def good():
+            return ["verse"]
+
+        async def failing():
+            raise RuntimeError("upstream down")
+
+        assert await cache.get_or_load("key", good) == ["verse"]
+        await asyncio.sleep(0.03)
+        assert await cache.get_or_load("key", failing) == ["verse"]
+        assert cache.fallback_hits == 1
+
+    asyncio.run(scenario())
+
+
+def test_failed_load_without_stale_ttl_raises():
+    cache = server.AsyncTTLCache("principals", max_entries=10, ttl=0.01)
+
+    async def scenario():
+        async def good():
+            return "principal"
+
+        async def failing():
+            raise RuntimeError("mongo down")
+
+        assert await cache.get_or_load("key", good) == "principal"
+        await asyncio.sleep(0.02)
+        with pytest.raises(RuntimeError):
+            await cache.get_or_load("key", failing)
+
+    asyncio.run(scenario())
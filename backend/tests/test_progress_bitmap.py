@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from bson.int64 import Int64
+
+import server
+from server import TOTAL_AYAHS, ayah_bit, bitmap_array, build_bitmap_document, to_int64
+
+ALL_ONES = (1 << 64) - 1
+
+
+def test_ayah_bit_positions():
+    assert ayah_bit(1, 1) == 0
+    assert ayah_bit(1, 7) == 6
+    assert ayah_bit(2, 1) == 7
+    assert ayah_bit(114, 6) == TOTAL_AYAHS - 1
+    for surah_number, ayah_number in [(0, 1), (115, 1), (1, 0), (1, 8)]:
+        with pytest.raises(ValueError):
+            ayah_bit(surah_number, ayah_number)
+
+
+def test_to_int64_reinterprets_unsigned_words():
+    assert to_int64(0) == 0
+    assert to_int64((1 << 63) - 1) == (1 << 63) - 1
+    assert to_int64(1 << 63) == -(1 << 63)
+    assert to_int64(ALL_ONES) == -1
+    assert isinstance(to_int64(5), Int64)
+
+
+def test_bitmap_array_round_trips_signed_words():
+    ayahs = [(1, 1), (2, 57), (2, 286), (114, 6)]
+    doc = build_bitmap_document("reader", ayahs)
+    bits = bitmap_array(doc["words"])
+    assert len(bits) == TOTAL_AYAHS
+    assert sorted(int(bit) for bit in bits.nonzero()[0]) == sorted(ayah_bit(*ayah) for ayah in ayahs)
+    # Bit 63 of the first word makes it negative once stored
+    assert doc["words"]["0"] < 0
+    assert doc["total_completed"] == 4
+
+
+class RecordingCollection:
+    def __init__(self, words):
+        self.words = {str(index): to_int64(word) for index, word in words.items()}
+        self.updates = []
+
+    async def find_one_and_update(self, query, update, **kwargs):
+        self.updates.append(update)
+        return {"words": dict(self.words)}
+
+    async def update_one(self, query, update):
+        self.updates.append(update)
+
+
+def run_update(monkeypatch, words, ayahs, completed):
+    collection = RecordingCollection(words)
+    monkeypatch.setattr(server.db, "user_progress_bitmaps", collection, raising=False)
+    asyncio.run(server.set_ayahs_completed("reader", ayahs, completed))
+    return collection.updates
+
+
+def test_set_masks_and_counts_only_flipped_bits(monkeypatch):
+    # 1:1 is already complete, 1:2 and 2:57 (bit 63) are new
+    updates = run_update(monkeypatch, {0: 1}, [(1, 1), (1, 2), (2, 57)], True)
+    assert updates[0]["$bit"] == {"words.0": {"or": to_int64(0b11 | (1 << 63))}}
+    assert updates[1]["$inc"] == {"surahs.1": 1, "surahs.2": 1, "total_completed": 2}
+
+
+def test_clear_path_ands_with_the_inverted_mask(monkeypatch):
+    # 1:1 and 2:57 are complete, 1:2 is not
+    updates = run_update(monkeypatch, {0: 1 | (1 << 63)}, [(1, 1), (1, 2), (2, 57)], False)
+    expected = ALL_ONES & ~(0b11 | (1 << 63))
+    assert updates[0]["$bit"] == {"words.0": {"and": to_int64(expected)}}
+    assert updates[1]["$inc"] == {"surahs.1": -1, "surahs.2": -1, "total_completed": -2}
+
+
+def test_clearing_unset_bits_changes_no_counters(monkeypatch):
+    updates = run_update(monkeypatch, {}, [(3, 1)], False)
+    assert len(updates) == 1
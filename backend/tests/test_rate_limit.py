@@ -0,0 +1,7 @@
+import server
+
+
+def test_webhook_and_probes_are_exempt():
+    assert server.rate_limiter.policy_for("/api/stripe-webhook") is None
+    assert server.rate_limiter.policy_for("/api/health") is None
+    assert server.rate_limiter.policy_for("/api/quran/chapters") is not None
@@ -0,0 +1,140 @@
+import asyncio
+
+import httpx
+import pytest
+
+import server
+from server import CircuitBreaker, RetryBudget, UpstreamClientPool
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("verses", failure_threshold=3, open_seconds=30)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["short_circuited"] == 1
+
+
+def test_breaker_allows_one_probe_after_the_open_period(clock):
+    breaker = CircuitBreaker("verses", failure_threshold=1, open_seconds=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker("verses", failure_threshold=1, open_seconds=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_total == 2
+    assert not breaker.allow()
+
+
+def test_stuck_probe_frees_the_slot(clock):
+    breaker = CircuitBreaker("verses", failure_threshold=1, open_seconds=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    clock[0] += 30
+    assert breaker.allow()
+
+
+def test_retry_budget_bounds_extra_attempts():
+    budget = RetryBudget(ratio=0.5, minimum=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    assert budget.exhausted == 1
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == budget.capacity
+
+
+def make_pool(handler):
+    pool = UpstreamClientPool("http://upstream")
+    pool.client = httpx.AsyncClient(base_url="http://upstream", transport=httpx.MockTransport(handler))
+    return pool
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(server, "UPSTREAM_RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(server, "UPSTREAM_RETRY_MAX_DELAY", 0.001)
+
+
+def test_retries_transient_statuses(fast_retries):
+    statuses = iter([503, 200])
+    pool = make_pool(lambda request: httpx.Response(next(statuses)))
+    response = asyncio.run(pool.get("verses", "/verses"))
+    assert response.status_code == 200
+    assert pool.retries_total == 1
+    assert pool.breakers["verses"].consecutive_failures == 0
+
+
+def test_exhausted_budget_stops_retries(fast_retries):
+    pool = make_pool(lambda request: httpx.Response(503))
+    pool.retry_budget.tokens = 0.0
+    response = asyncio.run(pool.get("verses", "/verses"))
+    assert response.status_code == 503
+    assert pool.retries_total == 0
+    assert pool.requests_total == 1
+
+
+def test_open_breaker_fails_fast():
+    pool = make_pool(lambda request: httpx.Response(200))
+    pool.breaker("verses").state = CircuitBreaker.OPEN
+    pool.breaker("verses").opened_at = server.monotonic()
+    with pytest.raises(server.UpstreamUnavailable):
+        asyncio.run(pool.get("verses", "/verses"))
+    assert pool.requests_total == 0
+
+
+def test_slow_attempt_is_hedged(monkeypatch):
+    monkeypatch.setattr(server, "UPSTREAM_HEDGING", True)
+    monkeypatch.setattr(server, "UPSTREAM_HEDGE_MIN_DELAY", 0.01)
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(5)
+        return httpx.Response(200, json={"attempt": len(calls)})
+
+    pool = make_pool(handler)
+    pool.latencies["verses"].extend([0.01] * 20)
+    response = asyncio.run(pool.get("verses", "/verses"))
+    assert response.json() == {"attempt": 2}
+    assert pool.hedges_total == 1
+    assert pool.hedge_wins == 1
+
+
+def test_no_hedge_without_latency_history(monkeypatch):
+    monkeypatch.setattr(server, "UPSTREAM_HEDGING", True)
+    pool = make_pool(lambda request: httpx.Response(200))
+    assert pool.hedge_delay("verses") is None
+    asyncio.run(pool.get("verses", "/verses"))
+    assert pool.hedges_total == 0
@@ -1,6 +1,8 @@
 const CACHE_NAME = 'my-quran-journey-v1.0.0';
 const STATIC_CACHE_NAME = 'my-quran-journey-static-v1.0.0';
 const DYNAMIC_CACHE_NAME = 'my-quran-journey-dynamic-v1.0.0';
+const BUNDLE_CACHE_NAME = 'my-quran-journey-bundles-v1';
+const BUNDLE_MANIFEST_PATH = '/api/quran/bundles/manifest';
 
 // Files to cache for offline functionality
 const STATIC_FILES = [
@@ -47,7 +49,7 @@ self.addEventListener('activate', (event) => {
       .then((cacheNames) => {
         return Promise.all(
           cacheNames.map((cacheName) => {
-            if (cacheName !== STATIC_CACHE_NAME && cacheName !== DYNAMIC_CACHE_NAME) {
+            if (cacheName !== STATIC_CACHE_NAME && cacheName !== DYNAMIC_CACHE_NAME && cacheName !== BUNDLE_CACHE_NAME) {
               console.log('Service Worker: Deleting old cache', cacheName);
               return caches.delete(cacheName);
             }
@@ -80,6 +82,16 @@ self.addEventListener('fetch', (event) => {
 async function handleApiRequest(request) {
   const url = new URL(request.url);
   
+  // Bundles are content-addressed and immutable: cache-first, never revalidated
+  if (url.pathname.startsWith('/api/quran/bundle/') && request.method === 'GET') {
+    const cache = await caches.open(BUNDLE_CACHE_NAME);
+    const cachedBundle = await cache.match(request);
+    if (cachedBundle) {
+      return cachedBundle;
+    }
+    return fetch(request);
+  }
+  
   // Cache-first strategy for read-only endpoints
   const cacheFirstEndpoints = [
     '/api/quran/chapters',
@@ -122,6 +134,10 @@ async function handleApiRequest(request) {
       
     } catch (error) {
       console.error('Service Worker: Error handling API request', error);
+      const bundleResponse = await versesFromBundle(url);
+      if (bundleResponse) {
+        return bundleResponse;
+      }
       return new Response(
         JSON.stringify({ error: 'Offline - data not available' }),
         {
@@ -359,4 +375,92 @@ self.addEventListener('message', (event) => {
   }
 });
 
+// Download offline chapter bundles whose hash changed since the last sync.
+// The API lives on its own origin (REACT_APP_BACKEND_URL), passed as apiBase.
+self.addEventListener('message', (event) => {
+  if (event.data && event.data.type === 'SYNC_BUNDLES') {
+    const apiBase = event.data.apiBase || self.location.origin;
+    syncBundles(apiBase, event.data.reciter || '7', event.data.chapters)
+      .then((result) => {
+        if (event.ports[0]) event.ports[0].postMessage({ success: true, ...result });
+      })
+      .catch((error) => {
+        console.error('Service Worker: Error syncing bundles', error);
+        if (event.ports[0]) event.ports[0].postMessage({ success: false, error: error.message });
+      });
+  }
+});
+
+async function syncBundles(apiBase, reciter, chapters) {
+  const cache = await caches.open(BUNDLE_CACHE_NAME);
+  const manifestUrl = new URL(BUNDLE_MANIFEST_PATH, apiBase).href;
+  const response = await fetch(manifestUrl, { cache: 'no-cache' });
+  if (!response.ok) {
+    throw new Error(`Manifest request failed with ${response.status}`);
+  }
+  const manifest = await response.clone().json();
+  const wanted = new Set(
+    Object.keys(manifest.bundles)
+      .filter((chapterId) => !chapters || chapters.includes(Number(chapterId)))
+      .map((chapterId) => manifest.bundles[chapterId][reciter])
+      .filter(Boolean)
+      .map((entry) => new URL(entry.url, apiBase).href)
+  );
+  
+  // Drop bundles the manifest no longer lists for this reciter
+  const cachedRequests = await cache.keys();
+  const cachedUrls = new Set();
+  for (const cachedRequest of cachedRequests) {
+    const isManifest = new URL(cachedRequest.url).pathname === BUNDLE_MANIFEST_PATH;
+    const isThisReciter = cachedRequest.url.split('/').slice(-2, -1)[0] === reciter;
+    if (!isManifest && isThisReciter && !wanted.has(cachedRequest.url)) {
+      await cache.delete(cachedRequest);
+    } else {
+      cachedUrls.add(cachedRequest.url);
+    }
+  }
+  
+  let downloaded = 0;
+  for (const bundleUrl of wanted) {
+    if (!cachedUrls.has(bundleUrl)) {
+      await cache.add(bundleUrl);
+      downloaded += 1;
+    }
+  }
+  await cache.put(manifestUrl, response);
+  console.log(`Service Worker: Bundles synced, ${downloaded} downloaded`);
+  return { downloaded, total: wanted.size };
+}
+
+// Serve /api/quran/chapter/{id}/verses from a cached bundle when offline
+async function versesFromBundle(url) {
+  const match = url.pathname.match(/^\/api\/quran\/chapter\/(\d+)\/verses$/);
+  if (!match || typeof DecompressionStream === 'undefined') {
+    return null;
+  }
+  const cache = await caches.open(BUNDLE_CACHE_NAME);
+  const bundleRequest = (await cache.keys()).find((cachedRequest) =>
+    new URL(cachedRequest.url).pathname.startsWith(`/api/quran/bundle/${match[1]}/`)
+  );
+  if (!bundleRequest) {
+    return null;
+  }
+  const bundleResponse = await cache.match(bundleRequest);
+  const text = await new Response(
+    bundleResponse.body.pipeThrough(new DecompressionStream('gzip'))
+  ).text();
+  const bundle = JSON.parse(text);
+  const perPage = Number(url.searchParams.get('per_page')) || bundle.verses.length;
+  const page = Number(url.searchParams.get('page')) || 1;
+  const verses = bundle.verses.slice((page - 1) * perPage, page * perPage);
+  return new Response(JSON.stringify(verses), {
+    status: 200,
+    headers: {
+      'Content-Type': 'application/json',
+      'X-Total-Count': String(bundle.chapter.verses_count),
+      'X-Offline-Bundle': 'true'
+    }
+  });
+}
+
 console.log('Service Worker: Loaded successfully');
@@ -19,11 +19,32 @@ if ('serviceWorker' in navigator) {
     navigator.serviceWorker.register('/sw.js')
       .then((registration) => {
         console.log('SW registered: ', registration);
+        return navigator.serviceWorker.ready;
       })
+      .then(syncOfflineBundles)
       .catch((registrationError) => {
         console.log('SW registration failed: ', registrationError);
       });
   });
+  
+  // Refresh bundles when connectivity returns
+  window.addEventListener('online', () => {
+    navigator.serviceWorker.ready.then(syncOfflineBundles);
+  });
+}
+
+// Ask the service worker to fetch offline chapter bundles that changed.
+// Skipped on metered connections where the user asked to save data.
+function syncOfflineBundles(registration) {
+  const connection = navigator.connection;
+  if (!registration.active || !navigator.onLine || (connection && connection.saveData)) {
+    return;
+  }
+  registration.active.postMessage({
+    type: 'SYNC_BUNDLES',
+    apiBase: process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001',
+    reciter: '7'
+  });
 }
 
 // PWA install prompt